@@ -3,11 +3,29 @@ from discord.ext import commands
 from discord import app_commands
 import json
 import os
+import re
+import sys
+import argparse
+import bisect
+import collections
 import datetime
+from array import array
 import shutil
+import gzip
+import hashlib
+import csv
+import io
+import tempfile
+import random
 import asyncio
-from flask import Flask
-from threading import Thread
+import inspect
+import contextvars
+import subprocess
+import time
+import math
+import heapq
+from flask import Flask, request, jsonify
+from threading import Thread, Lock
 import aiohttp
 
 # Global configuration
@@ -15,25 +33,76 @@ MAX_TOKENS_PER_USER = 3  # Maximum number of tokens a user can have
 BACKUP_DIR = 'backups'
 MAX_BACKUPS = 5  # Maximum number of backups to keep
 BACKUP_INTERVAL = 24 * 60 * 60  # 24 hours in seconds
+BACKUP_VERIFY_INTERVAL = 6 * 60 * 60  # Seconds between checksum checks of all backups
+KEEP_ALIVE_INTERVAL = 2 * 60  # Seconds between pings of the web server
+RECONCILE_INTERVAL = 60 * 60  # Seconds between checks for tokens held by members who already left
+SCHEDULER_JITTER = 30  # Most seconds a scheduled run is delayed past its slot (at most a tenth of the interval)
 DEFAULT_LOG_ENTRIES = 10  # Default number of log entries to show
+DEFAULT_REPORT_ENTRIES = 10  # Default number of users to show in token reports
+ROLLUP_FLUSH_INTERVAL = 60  # Seconds between writes of the daily rollups and audit counters to disk
+VERIFY_TEAM_LIST_CHARS = 3500  # Most characters of player lines in one /verify-team embed
+MAX_LOG_MESSAGE_LENGTH = 1900  # Keep /log output under Discord's 2000 character limit
+LOG_SEGMENT_MAX_BYTES = 5 * 1024 * 1024  # Roll the transaction log into a new segment at this size
+LOG_SEGMENT_MAX_DAYS = 30  # ...or when its oldest entry is this many days old
+MAX_LOG_ARCHIVES = 0  # Maximum number of compressed log segments to keep (0 keeps all)
+AUDIT_SAMPLE_RATE = 1.0  # Fraction of read-only command uses written to the audit log (all are counted)
+EXPORT_PART_BYTES = 8 * 1024 * 1024  # Largest export attachment (Discord's upload limit is 10 MB)
+API_CACHE_SECONDS = 5  # How long HTTP clients may reuse a balances API response
+API_CACHE_MAX_GUILDS = 256  # Serialized guild balances kept for the balances API
+API_READ_TIMEOUT = 5  # Seconds the balances API waits for a read on the bot's event loop
+NOTIFY_BATCH_SECONDS = 5  # Admin actions within this window are combined into one notification
+NOTIFY_CHANNEL_INTERVAL = 2  # Minimum seconds between notifications to one channel
+NOTIFY_QUEUE_SIZE = 1000  # Pending notification events; beyond this they are only counted
+NOTIFY_MAX_LINES = 15  # Events listed in one notification; the rest are summarized
+SNAPSHOT_EVERY_EVENTS = 500  # Write a ledger snapshot after this many new events
+TOKEN_EXPIRY_DAYS = 0  # Days after being given before tokens expire (0 = tokens never expire)
+MAX_EXPIRY_WAIT = 60 * 60  # Longest the expiry scheduler sleeps before re-checking the clock
 
 # Bot configuration
 TOKEN = os.environ.get('BOT_TOKEN')
-TOKEN_FILE = 'token_data.json'
+TOKEN_FILE = 'token_data.json'  # Plain balances view, rewritten with every ledger snapshot
+LEDGER_EVENTS_FILE = 'ledger_events.jsonl'  # Append-only ledger history, the source of truth for balances
+LEDGER_SNAPSHOT_FILE = 'ledger_snapshot.json'
 LOG_FILE = 'token_transactions.log'
+AUDIT_LOG_FILE = 'token_audit.log'  # Read-only command usage, kept out of the ledger log
+ROLLUP_FILE = 'token_rollups.json'
+LOG_ARCHIVE_DIR = 'log_archive'
+LOG_CHECKPOINT_FILE = os.path.join(LOG_ARCHIVE_DIR, 'log_checkpoint.json')
+BACKUP_MANIFEST_FILE = os.path.join(BACKUP_DIR, 'backup_manifest.json')  # Ledger position and checksum of each backup
 ADMIN_ROLE_NAME = 'Admin'  # Change this to match your server's admin role
+NOTIFY_CHANNEL_NAME = 'token-log'  # Admin actions are mirrored to a channel with this name, if the server has one
+BALANCES_API_KEY = os.environ.get('BALANCES_API_KEY')  # Bearer token required by the balances API when set
+
+# Sharding configuration (set by "python main.py sharded" for each bot process)
+SHARD_COUNT = int(os.environ['SHARD_COUNT']) if os.environ.get('SHARD_COUNT') else None
+SHARD_IDS = [int(shard_id) for shard_id in os.environ.get('SHARD_IDS', '').split(',') if shard_id.strip()] or None
+LEDGER_SOCKET = os.environ.get('LEDGER_SOCKET')  # Unix socket of the ledger coordinator; unset runs the ledger in-process
+DEFAULT_LEDGER_SOCKET = 'ledger.sock'
+LEDGER_FRAME_LIMIT = 16 * 1024 * 1024  # Maximum size of one batched coordinator message
 
 # Initialize bot with intents
 intents = discord.Intents.default()
 intents.members = True
 intents.message_content = True
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+# Traces the HTTP sends of discord.py's session, for the REST metrics
+rest_trace = aiohttp.TraceConfig()
+
+if SHARD_COUNT:
+    # Each process connects only the gateway shards it owns
+    bot = commands.AutoShardedBot(command_prefix='!', intents=intents, http_trace=rest_trace,
+                                  shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents, http_trace=rest_trace)
 
 # Ensure backup directory exists
 if not os.path.exists(BACKUP_DIR):
     os.makedirs(BACKUP_DIR)
 
+# Ensure log archive directory exists
+if not os.path.exists(LOG_ARCHIVE_DIR):
+    os.makedirs(LOG_ARCHIVE_DIR)
+
 # Load token data
 def load_token_data():
     try:
@@ -55,38 +124,703 @@ def save_token_data(data):
         print(f"Error saving token data: {str(e)}")
         return False
 
-# Log transaction
-def log_transaction(guild_name, action, admin=None, member=None, amount=None):
-    try:
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"[{timestamp}] [{guild_name}] {action}"
+# Token counts of one guild, stored compactly
+class GuildBalances:
+    """
+    Sorted user ids in an array of unsigned 64-bit ints with the token counts in a parallel
+    array of unsigned 16-bit ints: about 10 bytes per holder instead of the ~150 a dict entry
+    with string keys costs. Supports the subset of the dict interface the ledger uses and
+    accepts user ids as ints or strings.
+    """
+    __slots__ = ('user_ids', 'tokens')
+    MAX_TOKENS = 0xFFFF
+
+    def __init__(self, users=None):
+        items = sorted((int(user_id), tokens) for user_id, tokens in (users or {}).items() if tokens > 0)
+        self.user_ids = array('Q', [user_id for user_id, _ in items])
+        self.tokens = array('H', [tokens for _, tokens in items])
+
+    # Position of a user id, or -1 if it holds no tokens
+    def _find(self, user_id):
+        index = bisect.bisect_left(self.user_ids, user_id)
+        if index < len(self.user_ids) and self.user_ids[index] == user_id:
+            return index
+        return -1
+
+    def get(self, user_id, default=0):
+        index = self._find(int(user_id))
+        return self.tokens[index] if index >= 0 else default
+
+    def __getitem__(self, user_id):
+        index = self._find(int(user_id))
+        if index < 0:
+            raise KeyError(user_id)
+        return self.tokens[index]
+
+    def __setitem__(self, user_id, tokens):
+        user_id = int(user_id)
+        index = bisect.bisect_left(self.user_ids, user_id)
+        if index < len(self.user_ids) and self.user_ids[index] == user_id:
+            self.tokens[index] = tokens
+        else:
+            self.user_ids.insert(index, user_id)
+            self.tokens.insert(index, tokens)
+
+    def pop(self, user_id, default=None):
+        index = self._find(int(user_id))
+        if index < 0:
+            return default
+        tokens = self.tokens[index]
+        del self.user_ids[index]
+        del self.tokens[index]
+        return tokens
+
+    def __contains__(self, user_id):
+        return self._find(int(user_id)) >= 0
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __iter__(self):
+        return (str(user_id) for user_id in self.user_ids)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        return ((str(user_id), tokens) for user_id, tokens in zip(self.user_ids, self.tokens))
+
+    # Plain {user_id: tokens} with string keys, the JSON format of snapshots and backups
+    def to_dict(self):
+        return dict(self.items())
+
+    # Independent copy; copying the arrays is a flat memory copy
+    def copy(self):
+        duplicate = GuildBalances()
+        duplicate.user_ids = array('Q', self.user_ids)
+        duplicate.tokens = array('H', self.tokens)
+        return duplicate
+
+    # Bytes held by this guild's balances
+    def memory_usage(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.user_ids) + sys.getsizeof(self.tokens)
+
+# Event-sourced token ledger
+class TokenLedger:
+    """
+    Balances are derived from an append-only event log. A snapshot of the balances and the
+    event log position it covers is written every SNAPSHOT_EVERY_EVENTS events, so startup
+    loads the snapshot and replays only the tail of the log.
+
+    Events are JSON lines with a "seq" number and a "type":
+    - "mutation": {"guild_id", "changes": {user_id: delta}, "reason", optional "expires_at"}
+    - "reset_guild": {"guild_id"}
+    - "restore": {"balances": {guild_id: {user_id: tokens}}, "source", optional "grants"}
+
+    Tokens given with an "expires_at" (unix seconds) are tracked as grants
+    {guild_id: {user_id: [[expires_at, amount], ...]}}, soonest expiry first. Removals use up
+    the soonest-expiring grants before tokens that never expire. A min-heap of
+    (expires_at, guild_id, user_id) lets the expiry scheduler find due grants without
+    scanning every holder; it is rebuilt from the grants on load.
+
+    In memory each guild's balances are a GuildBalances; snapshots, backups and replays use
+    plain {guild_id: {user_id: tokens}} dicts.
+
+    freeze() captures the state at the current event without copying balances: the frozen
+    GuildBalances objects are shared, and a guild is copied the first time it is mutated
+    afterwards (copy-on-write). Frozen states are serialized in worker threads while the
+    live ledger keeps changing.
+    """
 
-        if admin:
-            try:
-                log_entry += f" | Admin: {admin.name}"
-                if hasattr(admin, 'discriminator') and admin.discriminator != '0':
-                    log_entry += f"#{admin.discriminator}"
-            except AttributeError:
-                log_entry += f" | Admin: {admin}"
-                
-        if member:
-            try:
-                log_entry += f" | Member: {member.name}"
-                if hasattr(member, 'discriminator') and member.discriminator != '0':
-                    log_entry += f"#{member.discriminator}"
-            except AttributeError:
-                log_entry += f" | Member: {member}"
-                
-        if amount is not None:
-            log_entry += f" | Amount: {amount}"
+    def __init__(self, events_file, snapshot_file):
+        self.events_file = events_file
+        self.snapshot_file = snapshot_file
+        self.seq = 0
+        self.balances = {}
+        self.events_offset = 0
+        self.snapshot_seq = 0
+        self.grants = {}
+        self.expiry_heap = []
+        self.expiry_wakeup = None  # asyncio.Event set by the expiry scheduler
+        self.guild_seq = {}  # Event number of the last change to each guild
+        self.restore_seq = 0  # Event number of the last change to all guilds
+        self.shared_guilds = set()  # Guilds whose GuildBalances is shared with a frozen state
+        self.snapshot_lock = Lock()
+        self.written_seq = 0  # Event number of the snapshot file on disk
+        self.guild_names = {}  # Last known name of each guild, for logging where no gateway connection exists
+
+    # Load the latest snapshot and replay the events written after it
+    def load(self):
+        self.seq = 0
+        self.balances = {}
+        self.grants = {}
+        self.guild_names = {}
+        self.events_offset = 0
+
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, 'r') as f:
+                snapshot = json.load(f)
+            self.seq = snapshot['seq']
+            self.balances = {guild_id: GuildBalances(users) for guild_id, users in snapshot['balances'].items()}
+            self.grants = snapshot.get('grants', {})
+            self.guild_names = snapshot.get('guild_names', {})
+            self.events_offset = snapshot['events_offset']
+        self.snapshot_seq = self.seq
+
+        replayed = 0
+        for event, end_offset in self.iter_events(self.events_offset):
+            if event['seq'] <= self.seq:
+                continue
+            self.apply_event(self.balances, event, self.grants, GuildBalances)
+            if event.get('guild_name'):
+                self.guild_names[event['guild_id']] = event['guild_name']
+            self.seq = event['seq']
+            self.events_offset = end_offset
+            replayed += 1
+
+        if self.seq == 0 and os.path.exists(TOKEN_FILE):
+            # First start on the event log: seed it with the existing balances file
+            self.append_event({'type': 'restore', 'balances': load_token_data(), 'source': TOKEN_FILE})
+            print(f"Migrated {TOKEN_FILE} into the ledger event log")
+        elif replayed >= SNAPSHOT_EVERY_EVENTS:
+            self.write_snapshot()
+
+        self.rebuild_expiry_heap()
+        self.guild_seq = {}
+        self.restore_seq = self.seq
+        print(f"Ledger loaded at event {self.seq} ({replayed} event(s) replayed)")
+        return self
+
+    # Stream events from a byte offset, yielding (event, offset after the event)
+    def iter_events(self, offset=0):
+        if not os.path.exists(self.events_file):
+            return
+        with open(self.events_file, 'rb') as f:
+            f.seek(offset)
+            for raw_line in f:
+                offset += len(raw_line)
+                if not raw_line.endswith(b'\n'):
+                    # A torn write at the end of the file; it was never acknowledged
+                    break
+                yield json.loads(raw_line), offset
+
+    # Apply one event to a balances mapping, and to a grants mapping when one is given
+    @staticmethod
+    def apply_event(balances, event, grants=None, guild_type=dict):
+        """
+        guild_type builds the per-guild balances: dict for replays, GuildBalances for the live ledger
+        """
+        if event['type'] == 'mutation':
+            if event['guild_id'] not in balances:
+                balances[event['guild_id']] = guild_type()
+            guild_balances = balances[event['guild_id']]
+            guild_grants = grants.setdefault(event['guild_id'], {}) if grants is not None else None
+            expires_at = event.get('expires_at')
+            for user_id, delta in event['changes'].items():
+                tokens = guild_balances.get(user_id, 0) + delta
+                if tokens > 0:
+                    guild_balances[user_id] = tokens
+                else:
+                    guild_balances.pop(user_id, None)
+
+                if guild_grants is None:
+                    continue
+                if tokens <= 0:
+                    guild_grants.pop(user_id, None)
+                elif delta > 0 and expires_at is not None:
+                    bisect.insort(guild_grants.setdefault(user_id, []), [expires_at, delta])
+                elif delta < 0 and user_id in guild_grants:
+                    TokenLedger.consume_grants(guild_grants, user_id, -delta)
+        elif event['type'] == 'reset_guild':
+            balances[event['guild_id']] = guild_type()
+            if grants is not None:
+                grants[event['guild_id']] = {}
+        elif event['type'] == 'restore':
+            balances.clear()
+            balances.update({guild_id: guild_type(users) for guild_id, users in event['balances'].items()})
+            if grants is not None:
+                grants.clear()
+                grants.update({guild_id: {user_id: [list(grant) for grant in user_grants]
+                                          for user_id, user_grants in users.items()}
+                               for guild_id, users in event.get('grants', {}).items()})
+
+    # Use up a user's soonest-expiring grants first
+    @staticmethod
+    def consume_grants(guild_grants, user_id, amount):
+        user_grants = guild_grants[user_id]
+        while amount > 0 and user_grants:
+            if user_grants[0][1] <= amount:
+                amount -= user_grants.pop(0)[1]
+            else:
+                user_grants[0][1] -= amount
+                amount = 0
+        if not user_grants:
+            del guild_grants[user_id]
+
+    # Append an event to the log and apply it to the in-memory balances
+    def append_event(self, event):
+        event = dict(event, seq=self.seq + 1, ts=datetime.datetime.now().strftime(LOG_TIMESTAMP_FORMAT))
+        line = (json.dumps(event, separators=(',', ':')) + '\n').encode('utf-8')
+        with open(self.events_file, 'ab') as f:
+            f.write(line)
+            self.events_offset = f.tell()
+
+        # Copy-on-write: never mutate balances a frozen state still refers to
+        if event['type'] == 'mutation' and event['guild_id'] in self.shared_guilds:
+            self.balances[event['guild_id']] = self.balances[event['guild_id']].copy()
+            self.shared_guilds.discard(event['guild_id'])
+        elif event['type'] == 'reset_guild':
+            self.shared_guilds.discard(event['guild_id'])
+        elif event['type'] == 'restore':
+            self.shared_guilds.clear()
+
+        self.apply_event(self.balances, event, self.grants, GuildBalances)
+        if event.get('guild_name'):
+            self.guild_names[event['guild_id']] = event['guild_name']
+        self.seq = event['seq']
+        if event['type'] == 'restore':
+            self.restore_seq = self.seq
+        else:
+            self.guild_seq[event['guild_id']] = self.seq
+
+        if event.get('expires_at') is not None:
+            for user_id, delta in event['changes'].items():
+                if delta > 0:
+                    heapq.heappush(self.expiry_heap, (event['expires_at'], event['guild_id'], user_id))
+            if self.expiry_wakeup is not None:
+                self.expiry_wakeup.set()
+
+        if self.seq - self.snapshot_seq >= SNAPSHOT_EVERY_EVENTS:
+            self.write_snapshot()
+        return event
+
+    # Persist the current balances with the event log position they correspond to
+    def write_snapshot(self):
+        state = self.freeze()
+        self.snapshot_seq = state['seq']
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self.write_snapshot_files(state)
+        # On the event loop the files are written by a worker thread
+        loop.run_in_executor(None, self.write_snapshot_files, state)
+        return True
+
+    # Capture the state after the current event for writing elsewhere
+    def freeze(self):
+        """
+        Returns: {"seq", "events_offset", "balances": {guild_id: GuildBalances}, "grants", "guild_names"}
+        The returned balances must not be modified. Grants are copied, as they are changed in place
+        """
+        self.shared_guilds.update(self.balances)
+        return {
+            'seq': self.seq,
+            'events_offset': self.events_offset,
+            'balances': dict(self.balances),
+            'grants': {guild_id: {user_id: [list(grant) for grant in user_grants]
+                                  for user_id, user_grants in users.items()}
+                       for guild_id, users in self.grants.items()},
+            'guild_names': dict(self.guild_names),
+        }
+
+    # Write a frozen state as the snapshot and the plain balances file
+    def write_snapshot_files(self, state):
+        try:
+            with self.snapshot_lock:
+                # A newer snapshot may have been written first by another thread
+                if state['seq'] < self.written_seq:
+                    return True
+                balances = {guild_id: users.to_dict() for guild_id, users in state['balances'].items()}
+                snapshot = {'seq': state['seq'], 'events_offset': state['events_offset'], 'balances': balances,
+                            'grants': state['grants'], 'guild_names': state['guild_names']}
+                temp_file = self.snapshot_file + '.tmp'
+                with open(temp_file, 'w') as f:
+                    json.dump(snapshot, f)
+                os.replace(temp_file, self.snapshot_file)
+                self.written_seq = state['seq']
+
+                # Keep the plain balances file in step for tools that read it directly
+                save_token_data(balances)
+            return True
+        except Exception as e:
+            print(f"Error writing ledger snapshot: {str(e)}")
+            return False
+
+    # Token count of one user
+    def get_balance(self, guild_id, user_id):
+        return self.balances.get(str(guild_id), {}).get(str(user_id), 0)
+
+    # Token counts of several users of a guild in one lookup
+    def get_balances(self, guild_id, user_ids):
+        guild_balances = self.balances.get(str(guild_id), {})
+        return {str(user_id): guild_balances.get(str(user_id), 0) for user_id in user_ids}
+
+    # Copy of all balances in a guild
+    def get_guild_balances(self, guild_id):
+        guild_balances = self.balances.get(str(guild_id))
+        return guild_balances.to_dict() if guild_balances else {}
+
+    # Event number of the last change to a guild's balances, usable as a cache validator
+    def guild_version(self, guild_id):
+        return max(self.guild_seq.get(str(guild_id), 0), self.restore_seq)
+
+    # Copy of all balances in all guilds
+    def to_dict(self):
+        return {guild_id: users.to_dict() for guild_id, users in self.balances.items()}
+
+    # Resident size of each guild's balances and pending grants
+    def memory_report(self):
+        """
+        Returns: {guild_id: {holders, balance_bytes, grant_holders, grant_bytes}}
+        """
+        report = {}
+        for guild_id, users in list(self.balances.items()):
+            guild_grants = self.grants.get(guild_id, {})
+            grant_bytes = sys.getsizeof(guild_grants) + sum(
+                sys.getsizeof(user_grants) + sum(sys.getsizeof(grant) for grant in user_grants)
+                for user_grants in list(guild_grants.values()))
+            report[guild_id] = {'holders': len(users), 'balance_bytes': users.memory_usage(),
+                                'grant_holders': len(guild_grants), 'grant_bytes': grant_bytes}
+        return report
+
+    # Apply token deltas for several users of a guild as one event
+    def apply_changes(self, guild_id, changes, reason, max_balance=None, expires_at=None, guild_name=None):
+        """
+        changes: {user_id: delta}
+        expires_at: unix time at which the tokens added by this event expire (None = never)
+        guild_name: recorded with the event so later expiries can be logged under the guild's name
+        Raises ValueError if any balance would become negative or exceed max_balance;
+        nothing is written in that case
+        Returns: {user_id: new balance}
+        """
+        guild_id = str(guild_id)
+        changes = {str(user_id): delta for user_id, delta in changes.items() if delta}
+        guild_balances = self.balances.get(guild_id, {})
+
+        for user_id, delta in changes.items():
+            new_balance = guild_balances.get(user_id, 0) + delta
+            if new_balance < 0:
+                raise ValueError(f"Balance of {user_id} would become negative")
+            if max_balance is not None and new_balance > max_balance:
+                raise ValueError(f"Balance of {user_id} would exceed {max_balance}")
+            if new_balance > GuildBalances.MAX_TOKENS:
+                raise ValueError(f"Balance of {user_id} would exceed {GuildBalances.MAX_TOKENS}")
+
+        if changes:
+            event = {'type': 'mutation', 'guild_id': guild_id, 'changes': changes, 'reason': reason}
+            if expires_at is not None:
+                event['expires_at'] = expires_at
+            if guild_name is not None:
+                event['guild_name'] = guild_name
+            self.append_event(event)
+        return {user_id: self.get_balance(guild_id, user_id) for user_id in changes}
+
+    # Remove all tokens in a guild
+    def reset_guild(self, guild_id):
+        self.append_event({'type': 'reset_guild', 'guild_id': str(guild_id)})
+
+    # Replace all balances, e.g. from a backup
+    def restore(self, balances, source, grants=None):
+        for users in balances.values():
+            if any(not 0 <= tokens <= GuildBalances.MAX_TOKENS for tokens in users.values()):
+                raise ValueError(f"Token counts must be between 0 and {GuildBalances.MAX_TOKENS}")
+        event = {'type': 'restore', 'balances': balances, 'source': source}
+        if grants:
+            event['grants'] = grants
+        self.append_event(event)
+        self.rebuild_expiry_heap()
+
+    # Rebuild the balances and grants as they were right after a given event by replaying the log
+    def replay(self, seq):
+        balances = {}
+        grants = {}
+        for event, _ in self.iter_events():
+            if event['seq'] > seq:
+                break
+            self.apply_event(balances, event, grants)
+        return balances, grants
+
+    # Rebuild the balances as they were right after a given event
+    def state_at(self, seq):
+        return self.replay(seq)[0]
+
+    # Pending expiries of one user, soonest first: [[expires_at, amount], ...]
+    def get_grants(self, guild_id, user_id):
+        return [list(grant) for grant in self.grants.get(str(guild_id), {}).get(str(user_id), [])]
+
+    # One heap entry per user and expiry time still held
+    def rebuild_expiry_heap(self):
+        self.expiry_heap = [(expires_at, guild_id, user_id)
+                            for guild_id, users in self.grants.items()
+                            for user_id, user_grants in users.items()
+                            for expires_at in {grant[0] for grant in user_grants}]
+        heapq.heapify(self.expiry_heap)
+        if self.expiry_wakeup is not None:
+            self.expiry_wakeup.set()
+
+    # Unix time of the next pending expiry, or None
+    def next_expiry(self):
+        return self.expiry_heap[0][0] if self.expiry_heap else None
+
+    # Remove every grant that has expired by now, one event per guild
+    def expire_due(self, now):
+        """
+        Only heap entries that are due are looked at. Entries whose grant was already used up
+        by a removal or deposit are skipped.
+        Returns: {guild_id: {user_id: tokens expired}}
+        """
+        due_users = set()
+        while self.expiry_heap and self.expiry_heap[0][0] <= now:
+            _, guild_id, user_id = heapq.heappop(self.expiry_heap)
+            due_users.add((guild_id, user_id))
+
+        expired = {}
+        for guild_id, user_id in due_users:
+            amount = sum(grant[1] for grant in self.grants.get(guild_id, {}).get(user_id, []) if grant[0] <= now)
+            if amount:
+                expired.setdefault(guild_id, {})[user_id] = amount
+
+        for guild_id, users in expired.items():
+            self.apply_changes(guild_id, {user_id: -amount for user_id, amount in users.items()}, "TOKEN_EXPIRED")
+        return expired
+
+# The ledger is loaded once and kept resident
+ledger = TokenLedger(LEDGER_EVENTS_FILE, LEDGER_SNAPSHOT_FILE)
+
+# Format a log line
+def format_log_entry(guild_name, action, admin=None, member=None, amount=None):
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    log_entry = f"[{timestamp}] [{guild_name}] {action}"
+
+    if admin:
+        try:
+            log_entry += f" | Admin: {admin.name}"
+            if hasattr(admin, 'discriminator') and admin.discriminator != '0':
+                log_entry += f"#{admin.discriminator}"
+        except AttributeError:
+            log_entry += f" | Admin: {admin}"
+            
+    if member:
+        try:
+            log_entry += f" | Member: {member.name}"
+            if hasattr(member, 'discriminator') and member.discriminator != '0':
+                log_entry += f"#{member.discriminator}"
+        except AttributeError:
+            log_entry += f" | Member: {member}"
+            
+    if amount is not None:
+        log_entry += f" | Amount: {amount}"
+
+    return log_entry
+
+# Log transaction (ledger mutations and admin actions)
+def log_transaction(guild, action, admin=None, member=None, amount=None):
+    log_entries = log_transactions([(guild, action, admin, member, amount)])
+    return log_entries[0] if log_entries else None
 
-        with open(LOG_FILE, 'a') as f:
-            f.write(log_entry + '\n')
+# Log several transactions with a single append
+def log_transactions(transactions):
+    """
+    transactions: list of (guild, action, admin, member, amount) tuples
+    guild is a discord.Guild, or a plain name for entries outside a server ("SYSTEM")
+    """
+    log_entries = [format_log_entry(getattr(guild, 'name', guild), action, admin, member, amount)
+                   for guild, action, admin, member, amount in transactions]
+    queue_notifications(transactions)
+
+    if LEDGER_SOCKET:
+        # Sharded mode: the coordinator owns the log file, the entries go out with the next batch
+        ledger_client.send_logs(log_entries)
+        return log_entries
+
+    return write_log_entries(log_entries)
+
+# Actions mirrored to each server's notification channel
+NOTIFY_ACTIONS = {"GIVE_TOKENS", "REMOVE_TOKENS", "DEPOSIT_TOKENS", "AUTO_REMOVE_LEFT_MEMBER", "RESET_ALL_TOKENS",
+                  "RESTORE_BACKUP", "TOKEN_EXPIRED", "IMPORT_BALANCES"}
+
+# Outbound notifications: (guild, action, line) tuples waiting for the worker. None until the worker runs
+notify_queue = None
+notify_stats = {'queued': 0, 'sent': 0, 'dropped': 0, 'errors': 0}
+# Events that did not fit in the queue, summarized in the next message: {guild_id: Counter of actions}
+notify_overflow = {}
+
+# Channel that receives a server's notifications, if it has one
+def get_notify_channel(guild):
+    return discord.utils.get(guild.text_channels, name=NOTIFY_CHANNEL_NAME)
+
+# One notification line for a transaction
+def format_notification(action, admin, member, amount):
+    line = f"**{action}**"
+    if member is not None:
+        line += f" {getattr(member, 'mention', member)}"
+    if amount is not None:
+        line += f" ({amount})"
+    if admin is not None:
+        line += f" by {getattr(admin, 'mention', admin)}"
+    return line
+
+# Hand transactions to the notification worker without ever waiting on it
+def queue_notifications(transactions):
+    if notify_queue is None:
+        return
+    for guild, action, admin, member, amount in transactions:
+        if action not in NOTIFY_ACTIONS or not hasattr(guild, 'text_channels') or get_notify_channel(guild) is None:
+            continue
+        try:
+            notify_queue.put_nowait((guild, action, format_notification(action, admin, member, amount)))
+            notify_stats['queued'] += 1
+        except asyncio.QueueFull:
+            # Overloaded: keep a count instead of the event
+            notify_overflow.setdefault(guild.id, collections.Counter())[action] += 1
+            notify_stats['dropped'] += 1
+
+# Collect queued notifications into per-guild batches and post one embed per batch
+async def notification_worker():
+    """
+    Events arriving within NOTIFY_BATCH_SECONDS of each other are combined. A channel gets at
+    most one message per NOTIFY_CHANNEL_INTERVAL; a batch for a channel that is not ready yet
+    waits for the next round. Each batch keeps at most NOTIFY_MAX_LINES lines and counts the rest.
+    """
+    loop = asyncio.get_running_loop()
+    batches = {}  # {guild_id: {"guild", "lines", "extra": Counter}}
+    channel_ready_at = {}
+
+    # Add one queued event to its guild's batch
+    def add_to_batch(guild, action, line=None, count=1):
+        batch = batches.setdefault(guild.id, {'guild': guild, 'lines': [], 'extra': collections.Counter()})
+        if line is not None and len(batch['lines']) < NOTIFY_MAX_LINES:
+            batch['lines'].append(line)
+        else:
+            batch['extra'][action] += count
 
-        return log_entry
+    while True:
+        try:
+            if not batches:
+                add_to_batch(*await notify_queue.get())
+            deadline = loop.time() + NOTIFY_BATCH_SECONDS
+            while (timeout := deadline - loop.time()) > 0:
+                try:
+                    add_to_batch(*await asyncio.wait_for(notify_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Events dropped while the queue was full are reported as counts
+            for guild_id in list(notify_overflow):
+                guild = bot.get_guild(guild_id)
+                for action, count in notify_overflow.pop(guild_id).items():
+                    if guild is not None:
+                        add_to_batch(guild, action, count=count)
+
+            for guild_id in list(batches):
+                batch = batches[guild_id]
+                channel = get_notify_channel(batch['guild'])
+                if channel is None:
+                    del batches[guild_id]
+                    continue
+                if channel_ready_at.get(channel.id, 0) > loop.time():
+                    continue
+
+                del batches[guild_id]
+                channel_ready_at[channel.id] = loop.time() + NOTIFY_CHANNEL_INTERVAL
+                embed = discord.Embed(title="🏦 Token activity", description="\n".join(batch['lines']),
+                                      color=discord.Color.blue(), timestamp=datetime.datetime.now(datetime.timezone.utc))
+                if batch['extra']:
+                    embed.add_field(name=f"...and {sum(batch['extra'].values())} more",
+                                    value=", ".join(f"{action} ×{count}" for action, count in batch['extra'].most_common()))
+                try:
+                    await channel.send(embed=embed)
+                    notify_stats['sent'] += 1
+                except discord.HTTPException as e:
+                    notify_stats['errors'] += 1
+                    print(f"Error sending notification to {batch['guild'].name}: {str(e)}")
+        except Exception as e:
+            print(f"Error in notification worker: {str(e)}")
+            await asyncio.sleep(NOTIFY_BATCH_SECONDS)
+
+# Start the notification worker once per bot process
+def start_notification_worker():
+    global notify_queue
+    if notify_queue is None:
+        notify_queue = asyncio.Queue(maxsize=NOTIFY_QUEUE_SIZE)
+        asyncio.get_running_loop().create_task(notification_worker())
+
+# Append formatted entries to the transaction log
+def write_log_entries(log_entries):
+    if not log_entries:
+        return []
+    try:
+        lines = [(log_entry + '\n').encode('utf-8') for log_entry in log_entries]
+        with open(LOG_FILE, 'ab') as f:
+            f.write(b''.join(lines))
+            log_offset = f.tell()
+
+        # Keep the daily rollups and the query index in step with the log
+        line_start = log_offset - sum(len(line_bytes) for line_bytes in lines)
+        entry = None
+        for log_entry, line_bytes in zip(log_entries, lines):
+            entry = parse_log_line(log_entry)
+            update_rollups(entry, line_start + len(line_bytes))
+            update_log_index(entry, line_start, line_start + len(line_bytes))
+            line_start += len(line_bytes)
+
+        # Start a new segment once the live log is too large or too old
+        if should_rotate_log(entry, log_offset):
+            rotate_log_segment()
+
+        return log_entries
     except Exception as e:
         print(f"Error logging transaction: {str(e)}")
-        return None
+        return []
+
+# Usage counters for read-only commands since the last flush: {guild_name: {action: count}}
+audit_counters = {}
+
+# Log a read-only command to the audit stream
+def log_audit_event(guild_name, action, admin=None, member=None):
+    """
+    Every call is counted; only a sample of AUDIT_SAMPLE_RATE is written out as a full line
+    """
+    log_entry = None
+    if AUDIT_SAMPLE_RATE >= 1.0 or random.random() < AUDIT_SAMPLE_RATE:
+        log_entry = format_log_entry(guild_name, action, admin, member)
+
+    if LEDGER_SOCKET:
+        # Sharded mode: the coordinator owns the audit log and its counters
+        ledger_client.send_audit_event(guild_name, action, log_entry)
+    else:
+        record_audit_event(guild_name, action, log_entry)
+    return log_entry
+
+# Count an audit event and append its line, if it was sampled
+def record_audit_event(guild_name, action, log_entry=None):
+    try:
+        guild_counters = audit_counters.setdefault(guild_name, {})
+        guild_counters[action] = guild_counters.get(action, 0) + 1
+
+        if log_entry is not None:
+            with open(AUDIT_LOG_FILE, 'a') as f:
+                f.write(log_entry + '\n')
+    except Exception as e:
+        print(f"Error logging audit event: {str(e)}")
+
+# Write the read-only usage counters to the audit log as one summary line per guild
+def flush_audit_counters():
+    global audit_counters
+    if not audit_counters:
+        return True
+
+    counters, audit_counters = audit_counters, {}
+    try:
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with open(AUDIT_LOG_FILE, 'a') as f:
+            for guild_name, counts in counters.items():
+                summary = ", ".join(f"{action}={count}" for action, count in sorted(counts.items()))
+                f.write(f"[{timestamp}] [{guild_name}] AUDIT_SUMMARY | Counts: {summary}\n")
+        return True
+    except Exception as e:
+        print(f"Error flushing audit counters: {str(e)}")
+        return False
 
 # Get user transaction history
 def get_user_transactions(user_id, limit=10):
@@ -118,73 +852,53 @@ def is_admin(member):
         return False
 
 # Function to calculate total tokens given to a user from transaction log
-def get_user_token_summary(guild_name, user_id, username=None):
+def get_user_token_summary(guild_name, user_id, username=None, guild_id=None):
     """
-    Calculate total tokens given to a user by analyzing the transaction log
+    Calculate total tokens given to a user from the log checkpoint plus the live log segment
+    The current balance is the user's balance in guild_id
     Returns: (total_given, total_deposited, current_balance, net_tokens, total_removed)
     """
     try:
-        if not os.path.exists(LOG_FILE):
-            return 0, 0, 0, 0, 0
-            
-        with open(LOG_FILE, 'r') as f:
-            log_lines = f.readlines()
-        
         total_given = 0
         total_deposited = 0
-        total_removed = 0
         
-        # Search patterns for the user
-        search_patterns = []
+        # Names the user can appear under in the log
+        member_names = {str(user_id), f"<@{user_id}>"}
         if username:
-            search_patterns.extend([
-                f"Member: {username}#",
-                f"Member: {username}",
-                f"Member: <@{user_id}>"
-            ])
-        search_patterns.append(f"Member: {user_id}")
+            member_names.add(username)
         
-        for line in log_lines:
-            # Only check logs from the correct guild
-            if f"[{guild_name}]" not in line:
-                continue
-                
-            # Check if this line mentions our user
-            user_mentioned = any(pattern in line for pattern in search_patterns)
-            if not user_mentioned:
-                continue
+        def is_user(name):
+            return name in member_names or (username and name.startswith(f"{username}#"))
+        
+        # Archived segments are already summarized in the checkpoint
+        checkpoint, sources = get_log_sources()
+        checkpoint_aggregates = checkpoint['aggregates'].get(guild_name, {})
+        for name, stats in checkpoint_aggregates.items():
+            if is_user(name):
+                total_given += stats['net']
+                total_deposited += stats['deposited']
+        
+        for path in sources:
+            for entry, _ in iter_history_lines(path, guild_name):
+                if not entry['member'] or not is_user(entry['member']):
+                    continue
             
-            # Parse the amount from the log entry
-            amount = 0
-            if "| Amount: " in line:
-                try:
-                    amount_str = line.split("| Amount: ")[1].strip()
-                    # Handle cases where amount might have extra text
-                    amount = int(amount_str.split()[0])
-                except (ValueError, IndexError):
-                    amount = 0
+                amount = parse_log_amount(entry)
             
-            # Kategorisera transaktionstypen med ny logik
-            if "GIVE_TOKENS" in line:
-                total_given += amount
-            elif "DEPOSIT_TOKENS" in line:
-                total_deposited += amount
-            elif "REMOVE_TOKENS" in line:
-                # NYTT: När tokens tas bort, minska från total_given istället för att räkna separat
-                total_given -= amount
-                # Säkerställ att total_given inte blir negativt
-                if total_given < 0:
-                    total_given = 0
+                # Kategorisera transaktionstypen med ny logik
+                if entry['action'] == "GIVE_TOKENS":
+                    total_given += amount
+                elif entry['action'] == "DEPOSIT_TOKENS":
+                    total_deposited += amount
+                elif entry['action'] == "REMOVE_TOKENS":
+                    # NYTT: När tokens tas bort, minska från total_given istället för att räkna separat
+                    total_given -= amount
+                    # Säkerställ att total_given inte blir negativt
+                    if total_given < 0:
+                        total_given = 0
         
         # Get current balance
-        token_data = load_token_data()
-        current_balance = 0
-        
-        # Find the user's current balance in any guild data
-        for gid, guild_data in token_data.items():
-            if str(user_id) in guild_data:
-                current_balance = guild_data[str(user_id)]
-                break
+        current_balance = ledger.get_balance(guild_id, user_id)
         
         # Net tokens är nu bara total_given eftersom removed redan räknats bort
         net_tokens = total_given
@@ -195,28 +909,809 @@ def get_user_token_summary(guild_name, user_id, username=None):
         print(f"Error calculating user token summary: {str(e)}")
         return 0, 0, 0, 0, 0
 
+# Pattern for a single transaction log line written by log_transaction
+LOG_LINE_PATTERN = re.compile(r"^\[(?P<timestamp>[^\]]+)\] \[(?P<guild>.*?)\] (?P<action>[A-Z_]+)(?P<fields>.*)$")
+LOG_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+REPORT_SORT_KEYS = ["given", "deposited", "removed", "net"]
+HISTORY_ACTIONS = {"GIVE_TOKENS": "given", "DEPOSIT_TOKENS": "deposited", "REMOVE_TOKENS": "removed"}
+
+# Parse a transaction log line
+def parse_log_line(line):
+    """
+    Parse one line from the transaction log
+    Returns: dict with timestamp, guild, action, admin, member and amount, or None for unparsable lines
+    """
+    match = LOG_LINE_PATTERN.match(line.rstrip('\n'))
+    if not match:
+        return None
+
+    try:
+        timestamp = datetime.datetime.strptime(match.group('timestamp'), LOG_TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+
+    entry = {
+        'timestamp': timestamp,
+        'guild': match.group('guild'),
+        'action': match.group('action'),
+        'admin': None,
+        'member': None,
+        'amount': None
+    }
+
+    for field in match.group('fields').split(' | ')[1:]:
+        key, _, value = field.partition(': ')
+        if key == 'Admin':
+            entry['admin'] = value
+        elif key == 'Member':
+            entry['member'] = value
+        elif key == 'Amount':
+            entry['amount'] = value.strip()
+
+    return entry
+
+# Parse the numeric amount of a log entry (non-numeric amounts such as backup names count as 0)
+def parse_log_amount(entry):
+    try:
+        return int(entry['amount'].split()[0])
+    except (AttributeError, ValueError, IndexError):
+        return 0
+
+# Stream parsed entries from a log file without reading it into memory
+def iter_log_entries(log_file=LOG_FILE, guild_name=None):
+    if not os.path.exists(log_file):
+        return
+
+    with open(log_file, 'r') as f:
+        for line in f:
+            entry = parse_log_line(line)
+            if entry is None:
+                continue
+            if guild_name is not None and entry['guild'] != guild_name:
+                continue
+            yield entry
+
+# Empty per-user aggregate used by the log analytics
+def new_user_aggregate():
+    return {'given': 0, 'deposited': 0, 'removed': 0, 'net': 0, 'transactions': 0}
+
+# Fold one log entry into a {guild_name: {member_name: aggregate}} mapping
+def accumulate_log_entry(aggregates, entry):
+    action = entry['action']
+    if action not in HISTORY_ACTIONS or not entry['member']:
+        return
+
+    user_stats = aggregates.setdefault(entry['guild'], {}).setdefault(entry['member'], new_user_aggregate())
+    amount = parse_log_amount(entry)
+    user_stats['transactions'] += 1
+
+    if action == "GIVE_TOKENS":
+        user_stats['given'] += amount
+        user_stats['net'] += amount
+    elif action == "DEPOSIT_TOKENS":
+        user_stats['deposited'] += amount
+    else:
+        user_stats['removed'] += amount
+        # Same rule as get_user_token_summary: removals reduce net given, never below zero
+        user_stats['net'] = max(user_stats['net'] - amount, 0)
+
+# Compute per-user aggregates for every user in one pass over the log
+def compute_log_aggregates(guild_name=None, log_file=None):
+    """
+    Scan the transaction log once and aggregate GIVE/DEPOSIT/REMOVE activity per user
+    Without log_file, archived segments are taken from the checkpoint and only the live segment is read
+    Memory grows with the number of distinct users, not with the number of log lines
+    Returns: {guild_name: {member_name: {given, deposited, removed, net, transactions}}}
+    """
+    aggregates = {}
+    try:
+        if log_file is None:
+            checkpoint, sources = get_log_sources()
+            for checkpoint_guild, members in checkpoint['aggregates'].items():
+                if guild_name is None or checkpoint_guild == guild_name:
+                    aggregates[checkpoint_guild] = {name: dict(stats) for name, stats in members.items()}
+        else:
+            sources = [log_file]
+
+        for path in sources:
+            for entry, _ in iter_history_lines(path, guild_name):
+                accumulate_log_entry(aggregates, entry)
+    except Exception as e:
+        print(f"Error computing log aggregates: {str(e)}")
+    return aggregates
+
+# Build a sorted leaderboard from the aggregates of one guild
+def build_token_report(guild_aggregates, sort_by="given", limit=DEFAULT_REPORT_ENTRIES):
+    if sort_by not in REPORT_SORT_KEYS:
+        sort_by = "given"
+
+    ranked = sorted(guild_aggregates.items(),
+                    key=lambda x: (-x[1][sort_by], x[0]))
+    ranked = [(name, stats) for name, stats in ranked if stats[sort_by] > 0]
+    return ranked[:limit] if limit else ranked
+
+# Daily rollups: {"format": int, "log_offset": int, "segments": int,
+#                 "guilds": {guild_name: {"YYYY-MM-DD": {member_name: {given, deposited, removed, transactions, net, net_floor}}}}}
+# "log_offset" is the byte position in LOG_FILE up to which the rollups are complete,
+# "segments" the number of archived log segments they include.
+# A day moves a member's running net given from x to max(x + net, net_floor), the same
+# never-below-zero rule as accumulate_log_entry, so ranged and unranged totals agree
+ROLLUP_FORMAT = 2
+rollup_data = None
+rollups_dirty = False
+
+# Load rollups from disk, rebuilding them from the log if missing and catching up on unseen lines
+def load_rollups():
+    global rollup_data
+    try:
+        if os.path.exists(ROLLUP_FILE):
+            with open(ROLLUP_FILE, 'r') as f:
+                rollup_data = json.load(f)
+            if rollup_data.get('format') != ROLLUP_FORMAT:
+                # Written by an older version without the net fields
+                rebuild_rollups()
+            else:
+                catch_up_rollups()
+        else:
+            rebuild_rollups()
+    except Exception as e:
+        print(f"Error loading rollups, rebuilding from log: {str(e)}")
+        rebuild_rollups()
+    return rollup_data
+
+# Return the in-memory rollups, loading them on first use
+def get_rollups():
+    if rollup_data is None:
+        load_rollups()
+    return rollup_data
+
+# Add one parsed log entry to its daily bucket
+def add_entry_to_rollups(data, entry):
+    field = HISTORY_ACTIONS.get(entry['action'])
+    if field is None or not entry['member']:
+        return
+
+    day = entry['timestamp'].strftime("%Y-%m-%d")
+    bucket = data['guilds'].setdefault(entry['guild'], {}).setdefault(day, {}).setdefault(
+        entry['member'], {'given': 0, 'deposited': 0, 'removed': 0, 'transactions': 0, 'net': 0, 'net_floor': 0})
+    amount = parse_log_amount(entry)
+    bucket[field] += amount
+    bucket['transactions'] += 1
+
+    if field == 'given':
+        bucket['net'] += amount
+        bucket['net_floor'] += amount
+    elif field == 'removed':
+        bucket['net'] -= amount
+        bucket['net_floor'] = max(bucket['net_floor'] - amount, 0)
+
+# Apply log lines written after the stored offset (e.g. after a crash before the last flush)
+def catch_up_rollups():
+    global rollups_dirty
+    if rollup_data.get('segments', 0) != len(get_log_checkpoint()['segments']):
+        # The log was rotated since the rollups were last saved
+        rebuild_rollups()
+        return
+
+    if not os.path.exists(LOG_FILE):
+        return
+
+    if os.path.getsize(LOG_FILE) < rollup_data.get('log_offset', 0):
+        # The log was replaced underneath us, start over
+        rebuild_rollups()
+        return
+
+    with open(LOG_FILE, 'rb') as f:
+        f.seek(rollup_data.get('log_offset', 0))
+        for raw_line in f:
+            entry = parse_log_line(raw_line.decode('utf-8', errors='replace'))
+            if entry is not None:
+                add_entry_to_rollups(rollup_data, entry)
+        rollup_data['log_offset'] = f.tell()
+    rollups_dirty = True
+
+# Rebuild all rollups from the archived log segments and the live log
+def rebuild_rollups():
+    global rollup_data, rollups_dirty
+    rollup_data = {'format': ROLLUP_FORMAT, 'log_offset': 0, 'segments': count_log_segments(), 'guilds': {}}
+    for entry, _ in iter_archived_entries():
+        add_entry_to_rollups(rollup_data, entry)
+    catch_up_rollups()
+    rollups_dirty = True
+    flush_rollups()
+    return rollup_data
+
+# Record a freshly logged entry in the rollups
+def update_rollups(entry, log_offset):
+    global rollups_dirty
+    try:
+        data = get_rollups()
+        if log_offset <= data['log_offset']:
+            # Already included by the catch-up performed while loading
+            return
+        if entry is not None:
+            add_entry_to_rollups(data, entry)
+        data['log_offset'] = log_offset
+        rollups_dirty = True
+    except Exception as e:
+        print(f"Error updating rollups: {str(e)}")
+
+# Persist the rollups if they changed since the last flush
+def flush_rollups():
+    global rollups_dirty
+    if rollup_data is None or not rollups_dirty:
+        return True
+    try:
+        temp_file = ROLLUP_FILE + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(rollup_data, f)
+        os.replace(temp_file, ROLLUP_FILE)
+        rollups_dirty = False
+        return True
+    except Exception as e:
+        print(f"Error saving rollups: {str(e)}")
+        return False
+
+# Parse optional command date filters into an inclusive (start, end) date range
+def parse_date_range(start_date=None, end_date=None, days=None):
+    """
+    Accepts YYYY-MM-DD strings and/or a number of days back from today
+    Returns: (start, end) as datetime.date or None for an open end
+    Raises ValueError for malformed input
+    """
+    start = datetime.datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
+    end = datetime.datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
+
+    if days is not None:
+        if days <= 0:
+            raise ValueError("days must be a positive number")
+        start = datetime.date.today() - datetime.timedelta(days=days - 1)
+
+    if start and end and start > end:
+        raise ValueError("start date is after end date")
+    return start, end
+
+# Describe a date range for embeds
+def format_date_range(start, end):
+    if start is None and end is None:
+        return "all time"
+    return f"{start.isoformat() if start else 'beginning'} → {end.isoformat() if end else 'today'}"
+
+# Iterate the daily buckets of a guild that fall in a date range
+def iter_rollup_days(guild_name, start=None, end=None):
+    guild_days = get_rollups()['guilds'].get(guild_name, {})
+    start_key = start.isoformat() if start else None
+    end_key = end.isoformat() if end else None
+
+    # ISO dates sort lexicographically, so string comparison is enough
+    for day, members in guild_days.items():
+        if start_key and day < start_key:
+            continue
+        if end_key and day > end_key:
+            continue
+        yield day, members
+
+# Sum the rollups of a guild per member over a date range
+def get_guild_rollup_totals(guild_name, start=None, end=None):
+    """
+    Returns: {member_name: {given, deposited, removed, net, transactions}} in the same shape
+    as compute_log_aggregates, so it can feed build_token_report
+    """
+    totals = {}
+    for day, members in sorted(iter_rollup_days(guild_name, start, end), key=lambda item: item[0]):
+        for member_name, bucket in members.items():
+            user_stats = totals.setdefault(member_name, new_user_aggregate())
+            for field in ('given', 'deposited', 'removed', 'transactions'):
+                user_stats[field] += bucket[field]
+            user_stats['net'] = max(user_stats['net'] + bucket['net'], bucket['net_floor'])
+    return totals
+
+# Sum the rollups of a single user over a date range
+def get_user_rollup_totals(guild_name, member_names, start=None, end=None):
+    """
+    Returns: (total_given, total_deposited, total_removed, net_given)
+    """
+    given = deposited = removed = 0
+    nets = {member_name: 0 for member_name in member_names}
+    for day, members in sorted(iter_rollup_days(guild_name, start, end), key=lambda item: item[0]):
+        for member_name in member_names:
+            bucket = members.get(member_name)
+            if bucket:
+                given += bucket['given']
+                deposited += bucket['deposited']
+                removed += bucket['removed']
+                nets[member_name] = max(nets[member_name] + bucket['net'], bucket['net_floor'])
+    return given, deposited, removed, sum(nets.values())
+
+# Names a member may appear under in the log
+def get_log_names(member):
+    names = {member.name}
+    if hasattr(member, 'discriminator') and member.discriminator != '0':
+        names.add(f"{member.name}#{member.discriminator}")
+    return names
+
+# Actions that can be used to filter /log
+LOG_ACTIONS = ["GIVE_TOKENS", "REMOVE_TOKENS", "DEPOSIT_TOKENS", "AUTO_REMOVE_LEFT_MEMBER", "RESET_ALL_TOKENS",
+               "MANUAL_BACKUP", "RESTORE_BACKUP", "TOKEN_EXPIRED", "IMPORT_BALANCES"]
+
+# In-memory index of log line offsets: {"log_offset": int, "guilds": {guild_name: {"lines": array,
+# "action": {action: array}, "member": {name: array}, "admin": {name: array}}}}
+# Offsets are byte positions of line starts in LOG_FILE, stored in ascending order
+log_index = None
+log_rotations = 0  # Bumped on every rotation, so an index built from the previous file is discarded
+
+# Add one parsed entry to the index
+def add_entry_to_log_index(index, entry, offset):
+    guild_index = index['guilds'].setdefault(entry['guild'], {
+        'lines': array('Q'), 'action': {}, 'member': {}, 'admin': {}})
+    guild_index['lines'].append(offset)
+    guild_index['action'].setdefault(entry['action'], array('Q')).append(offset)
+    if entry['member']:
+        guild_index['member'].setdefault(entry['member'], array('Q')).append(offset)
+    if entry['admin']:
+        guild_index['admin'].setdefault(entry['admin'], array('Q')).append(offset)
+
+# Index log lines from the index's offset to the end of the file
+def catch_up_log_index(index):
+    if not os.path.exists(LOG_FILE):
+        return index
+
+    with open(LOG_FILE, 'rb') as f:
+        f.seek(index['log_offset'])
+        offset = index['log_offset']
+        for raw_line in f:
+            entry = parse_log_line(raw_line.decode('utf-8', errors='replace'))
+            if entry is not None:
+                add_entry_to_log_index(index, entry, offset)
+            offset += len(raw_line)
+        index['log_offset'] = offset
+    return index
+
+# Build the index with one scan of the log
+def build_log_index():
+    return catch_up_log_index({'log_offset': 0, 'guilds': {}})
+
+# Return the log index, building it on first use
+async def get_log_index():
+    global log_index
+    while log_index is None:
+        # Build in a worker thread; lines written meanwhile are picked up by the next catch-up
+        rotations = log_rotations
+        index = await asyncio.to_thread(build_log_index)
+        # Offsets of a file rotated away meanwhile do not apply to the new LOG_FILE
+        if log_index is None and rotations == log_rotations:
+            log_index = index
+    if os.path.exists(LOG_FILE) and os.path.getsize(LOG_FILE) != log_index['log_offset']:
+        catch_up_log_index(log_index)
+    return log_index
+
+# Record a freshly logged entry in the index (no-op until the index has been built)
+def update_log_index(entry, start_offset, end_offset):
+    try:
+        if log_index is None or end_offset <= log_index['log_offset']:
+            return
+        if start_offset != log_index['log_offset']:
+            # Lines were written that the index has not seen yet
+            catch_up_log_index(log_index)
+            return
+        if entry is not None:
+            add_entry_to_log_index(log_index, entry, start_offset)
+        log_index['log_offset'] = end_offset
+    except Exception as e:
+        print(f"Error updating log index: {str(e)}")
+
+# Read the timestamp of the first parsable line starting at or after a byte position
+def read_timestamp_at(f, position):
+    if position > 0:
+        # Skip the rest of the line we landed in
+        f.seek(position - 1)
+        f.readline()
+    else:
+        f.seek(0)
+
+    while True:
+        line_start = f.tell()
+        raw_line = f.readline()
+        if not raw_line:
+            return None, line_start
+        entry = parse_log_line(raw_line.decode('utf-8', errors='replace'))
+        if entry is not None:
+            return entry['timestamp'], line_start
+
+# Binary search for the offset of the first log line at or after a timestamp
+def find_log_offset(f, target, file_size):
+    """
+    Log lines are appended in timestamp order, so the byte offset of the first line
+    with timestamp >= target can be found in O(log size) seeks
+    """
+    lo, hi = 0, file_size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        timestamp, _ = read_timestamp_at(f, mid)
+        if timestamp is None or timestamp >= target:
+            hi = mid
+        else:
+            lo = mid + 1
+    return read_timestamp_at(f, lo)[1]
+
+# Merge the offset arrays of several index keys into one sorted list
+def merge_offsets(offset_lists):
+    if len(offset_lists) == 1:
+        return offset_lists[0]
+    merged = set()
+    for offsets in offset_lists:
+        merged.update(offsets)
+    return sorted(merged)
+
+# Read the most recent lines of the live segment matching the index filters and date range
+def read_indexed_log_lines(guild_index, file_size, action=None, member_names=None, admin_names=None,
+                           start=None, end=None, limit=DEFAULT_LOG_ENTRIES):
+    # Each filter narrows the candidate set; start from the most selective one
+    candidates = []
+    if action:
+        candidates.append(guild_index['action'].get(action, []))
+    if member_names:
+        candidates.append(merge_offsets([guild_index['member'].get(name, []) for name in member_names]))
+    if admin_names:
+        candidates.append(merge_offsets([guild_index['admin'].get(name, []) for name in admin_names]))
+    if not candidates:
+        candidates.append(guild_index['lines'])
+    candidates.sort(key=len)
+    offsets = candidates[0]
+    if len(candidates) > 1:
+        others = [set(c) for c in candidates[1:]]
+        offsets = [o for o in offsets if all(o in other for other in others)]
+
+    with open(LOG_FILE, 'rb') as f:
+        lo = find_log_offset(f, datetime.datetime.combine(start, datetime.time.min), file_size) if start else 0
+        hi = find_log_offset(f, datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min),
+                             file_size) if end else file_size
+
+        first = bisect.bisect_left(offsets, lo)
+        last = bisect.bisect_left(offsets, hi)
+        selected = offsets[max(first, last - limit):last]
+
+        lines = []
+        for offset in selected:
+            f.seek(offset)
+            lines.append(f.readline().decode('utf-8', errors='replace').strip())
+    return lines
+
+# Query the log with optional filters, returning the most recent matching lines
+async def query_log(guild_name, action=None, member_names=None, admin_names=None,
+                    start=None, end=None, limit=DEFAULT_LOG_ENTRIES):
+    """
+    Filters by action, member and admin are answered from the in-memory index;
+    a date range is located by binary search over file offsets. Archived segments are
+    only scanned when the live segment has fewer matches than requested
+    start/end are datetime.date values, both inclusive
+    Returns: list of log lines, oldest first
+    """
+    lines = []
+    if os.path.exists(LOG_FILE):
+        index = await get_log_index()
+        guild_index = index['guilds'].get(guild_name)
+        if guild_index is not None:
+            lines = read_indexed_log_lines(guild_index, index['log_offset'], action, member_names,
+                                           admin_names, start, end, limit)
+
+    # Fill up from archived segments when the live segment does not have enough matches
+    if len(lines) < limit and count_log_segments():
+        older = await asyncio.to_thread(query_archived_log, guild_name, action, member_names, admin_names,
+                                        start, end, limit - len(lines))
+        lines = older + lines
+    return lines
+
+# Linear scan of the archived segments overlapping a date range for matching lines
+def query_archived_log(guild_name, action=None, member_names=None, admin_names=None,
+                       start=None, end=None, limit=DEFAULT_LOG_ENTRIES):
+    matches = collections.deque(maxlen=limit)
+    for entry, line in iter_archived_entries(start, end):
+        if entry['guild'] != guild_name:
+            continue
+        if action and entry['action'] != action:
+            continue
+        if member_names and entry['member'] not in member_names:
+            continue
+        if admin_names and entry['admin'] not in admin_names:
+            continue
+        day = entry['timestamp'].date()
+        if (start and day < start) or (end and day > end):
+            continue
+        matches.append(line)
+    return list(matches)
+
+# Log segments: the live LOG_FILE is rolled into gzip-compressed archives in LOG_ARCHIVE_DIR.
+# The checkpoint stores the per-user aggregates of all archived segments, so history queries
+# only need the checkpoint plus the live segment:
+# {"segments": [{"file", "first", "last", "lines"}], "aggregates": {guild_name: {member_name: aggregate}}}
+LOG_ROTATING_SUFFIX = '.rotating'
+log_checkpoint = None
+live_segment_start = None
+log_rotation_lock = Lock()  # Rotated files are archived by worker threads, one at a time and in order
+
+# Read the checkpoint file from disk
+def read_log_checkpoint():
+    try:
+        if os.path.exists(LOG_CHECKPOINT_FILE):
+            with open(LOG_CHECKPOINT_FILE, 'r') as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"Error loading log checkpoint: {str(e)}")
+    return {'segments': [], 'aggregates': {}}
+
+# Atomically write the checkpoint file
+def save_log_checkpoint(checkpoint):
+    temp_file = LOG_CHECKPOINT_FILE + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_file, LOG_CHECKPOINT_FILE)
+
+# Return the checkpoint, finishing a rotation interrupted by a restart first
+def get_log_checkpoint():
+    global log_checkpoint
+    if log_checkpoint is None:
+        log_checkpoint = read_log_checkpoint()
+        finish_log_rotations()
+    return log_checkpoint
+
+# Rotated log files that were not archived yet, e.g. because of a restart mid-rotation
+def find_rotating_logs():
+    log_dir = os.path.dirname(LOG_FILE) or '.'
+    prefix = os.path.basename(LOG_FILE) + '.'
+    return sorted(os.path.join(log_dir, name) for name in os.listdir(log_dir)
+                  if name.startswith(prefix) and name.endswith(LOG_ROTATING_SUFFIX))
+
+# Segment number a rotated log file gets in the checkpoint
+def rotating_segment_number(rotating_file):
+    return int(os.path.basename(rotating_file).split('.')[-2])
+
+# Number of log segments, counting rotated files that are still being archived
+def count_log_segments():
+    pending = [rotating_segment_number(rotating_file) for rotating_file in find_rotating_logs()]
+    return max([len(get_log_checkpoint()['segments'])] + pending)
+
+# The checkpoint together with the log files it does not cover yet
+def get_log_sources():
+    """
+    A rotated log stays a source until the checkpoint that includes it is published, so readers
+    neither miss nor double count a segment while it is archived by the worker thread
+    Returns: (checkpoint, [rotated logs still being archived..., LOG_FILE]), oldest first
+    """
+    while True:
+        checkpoint = get_log_checkpoint()
+        pending = [rotating_file for rotating_file in find_rotating_logs()
+                   if rotating_segment_number(rotating_file) > len(checkpoint['segments'])]
+        # The checkpoint is published before the rotated file is removed; retry if that happened meanwhile
+        if checkpoint is log_checkpoint:
+            return checkpoint, pending + [LOG_FILE]
+
+# Stream parsed entries and their lines from a history file, oldest first
+def iter_history_lines(path, guild_name=None):
+    if not os.path.exists(path) and path.endswith(LOG_ROTATING_SUFFIX):
+        # Archived since the file was listed: read the segment it became instead
+        segment_number = rotating_segment_number(path)
+        archived = [name for name in os.listdir(LOG_ARCHIVE_DIR)
+                    if name.startswith(f"token_transactions_{segment_number:05d}_") and name.endswith('.log.gz')]
+        if not archived:
+            return
+        path = os.path.join(LOG_ARCHIVE_DIR, archived[0])
+    if not os.path.exists(path):
+        return
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            entry = parse_log_line(line)
+            if entry is None:
+                continue
+            if guild_name is not None and entry['guild'] != guild_name:
+                continue
+            yield entry, line.strip()
+
+# Timestamp of the first entry in a log file
+def read_first_log_timestamp(log_file):
+    for entry in iter_log_entries(log_file):
+        return entry['timestamp']
+    return None
+
+# Decide whether the live log should be rolled after writing an entry
+def should_rotate_log(entry, log_offset):
+    global live_segment_start
+    if log_offset >= LOG_SEGMENT_MAX_BYTES:
+        return True
+
+    if live_segment_start is None:
+        live_segment_start = read_first_log_timestamp(LOG_FILE)
+    if entry is None or live_segment_start is None:
+        return False
+    return (entry['timestamp'] - live_segment_start).days >= LOG_SEGMENT_MAX_DAYS
+
+# Roll the live log into a new archived segment
+def rotate_log_segment():
+    global log_index, log_rotations, live_segment_start, rollups_dirty
+    try:
+        if not os.path.exists(LOG_FILE) or os.path.getsize(LOG_FILE) == 0:
+            return False
+
+        # The rotated file is named after the segment number it will get in the checkpoint
+        segment_number = count_log_segments() + 1
+        rotating_file = f"{LOG_FILE}.{segment_number:05d}{LOG_ROTATING_SUFFIX}"
+
+        # Renaming is atomic, so new entries go to a fresh live log immediately
+        os.replace(LOG_FILE, rotating_file)
+        log_index = None
+        log_rotations += 1
+        live_segment_start = None
+
+        # The rollups already contain the rotated entries; their offset now refers to the new file
+        if rollup_data is not None:
+            rollup_data['log_offset'] = 0
+            rollup_data['segments'] = segment_number
+            rollups_dirty = True
+            flush_rollups()
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            finish_log_rotations()
+            return True
+        # On the event loop the segment is compressed and folded into the checkpoint by a worker thread
+        loop.run_in_executor(None, finish_log_rotations)
+        return True
+    except Exception as e:
+        print(f"Error rotating log segment: {str(e)}")
+        return False
+
+# Archive every rotated log that is still waiting, oldest first
+def finish_log_rotations():
+    with log_rotation_lock:
+        for rotating_file in find_rotating_logs():
+            try:
+                finish_log_rotation(rotating_file)
+            except Exception as e:
+                print(f"Error archiving log segment {rotating_file}: {str(e)}")
+                return
+
+# Compress the rotated log, fold it into the checkpoint and remove it
+def finish_log_rotation(rotating_file):
+    """
+    Safe to re-run after a crash: a segment number already present in the checkpoint is not counted twice
+    """
+    global log_checkpoint
+    checkpoint = read_log_checkpoint()
+    segment_number = rotating_segment_number(rotating_file)
+
+    first = last = None
+    lines = 0
+    for entry in iter_log_entries(rotating_file):
+        first = first or entry['timestamp']
+        last = entry['timestamp']
+        lines += 1
+
+    if first is not None and segment_number > len(checkpoint['segments']):
+        segment_file = f"token_transactions_{segment_number:05d}_{first.strftime('%Y%m%d%H%M%S')}.log.gz"
+        archive_path = os.path.join(LOG_ARCHIVE_DIR, segment_file)
+        with open(rotating_file, 'rb') as source, gzip.open(archive_path + '.tmp', 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(archive_path + '.tmp', archive_path)
+
+        for entry in iter_log_entries(rotating_file):
+            accumulate_log_entry(checkpoint['aggregates'], entry)
+
+        checkpoint['segments'].append({
+            'file': segment_file,
+            'first': first.strftime(LOG_TIMESTAMP_FORMAT),
+            'last': last.strftime(LOG_TIMESTAMP_FORMAT),
+            'lines': lines
+        })
+        save_log_checkpoint(checkpoint)
+        print(f"Archived log segment: {segment_file}")
+
+    # Published before the removal, see get_log_sources
+    log_checkpoint = checkpoint
+    os.remove(rotating_file)
+    cleanup_old_log_archives()
+
+# Delete the oldest compressed segments beyond MAX_LOG_ARCHIVES (their totals stay in the checkpoint)
+def cleanup_old_log_archives():
+    if not MAX_LOG_ARCHIVES:
+        return
+    try:
+        for segment in log_checkpoint['segments'][:-MAX_LOG_ARCHIVES]:
+            archive_path = os.path.join(LOG_ARCHIVE_DIR, segment['file'])
+            if os.path.exists(archive_path):
+                os.remove(archive_path)
+                print(f"Removed old log segment: {segment['file']}")
+    except Exception as e:
+        print(f"Error cleaning up old log segments: {str(e)}")
+
+# Stream parsed entries from the archived segments overlapping a date range, oldest first
+def iter_archived_entries(start=None, end=None):
+    """
+    Rotated logs that are still being archived come last; their dates are not known without reading them
+    """
+    checkpoint, sources = get_log_sources()
+    for segment in checkpoint['segments']:
+        if start and segment['last'][:10] < start.isoformat():
+            continue
+        if end and segment['first'][:10] > end.isoformat():
+            continue
+        yield from iter_history_lines(os.path.join(LOG_ARCHIVE_DIR, segment['file']))
+
+    for rotating_file in sources[:-1]:
+        yield from iter_history_lines(rotating_file)
+
+# Load the backup manifest:
+# {backup_filename: {"seq": ledger event number, "events_offset": byte position in the ledger event log,
+#                    "log_segments", "log_offset": transaction log position when the backup was taken,
+#                    "sha256", "size", "verified_at", "verify_error"}}
+def load_backup_manifest():
+    try:
+        if os.path.exists(BACKUP_MANIFEST_FILE):
+            with open(BACKUP_MANIFEST_FILE, 'r') as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"Error loading backup manifest: {str(e)}")
+    return {}
+
+# Save the backup manifest
+def save_backup_manifest(manifest):
+    try:
+        temp_file = BACKUP_MANIFEST_FILE + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temp_file, BACKUP_MANIFEST_FILE)
+        return True
+    except Exception as e:
+        print(f"Error saving backup manifest: {str(e)}")
+        return False
+
+# Write a frozen ledger state as a gzip-compressed balances file, one guild at a time
+def write_backup_file(backup_filename, state):
+    """
+    Runs in a worker thread; the frozen balances are never modified
+    Returns: (size, sha256) of the written file
+    """
+    temp_file = backup_filename + '.tmp'
+    with gzip.open(temp_file, 'wt', encoding='utf-8') as f:
+        f.write('{')
+        for i, (guild_id, users) in enumerate(state['balances'].items()):
+            f.write((',' if i else '') + json.dumps(guild_id) + ':' + json.dumps(users.to_dict()))
+        f.write('}')
+    os.replace(temp_file, backup_filename)
+    return os.path.getsize(backup_filename), file_sha256(backup_filename)
+
+# Current position in the transaction log: archived segment count and live segment size
+def get_log_position():
+    return {'log_segments': count_log_segments(),
+            'log_offset': os.path.getsize(LOG_FILE) if os.path.exists(LOG_FILE) else 0}
+
 # Backup token data
 async def backup_token_data():
+    # Create timestamp for filename
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     try:
-        # Create timestamp for filename
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"{BACKUP_DIR}/token_data_backup_{timestamp}.json"
+        backup_filename = f"{BACKUP_DIR}/token_data_backup_{timestamp}.json.gz"
         
-        # Check if original file exists
-        if os.path.exists(TOKEN_FILE):
-            # Copy the file
-            shutil.copy2(TOKEN_FILE, backup_filename)
-            
-            # Log the backup
-            log_transaction("SYSTEM", "AUTO_BACKUP", amount=timestamp)
-            print(f"[{timestamp}] Created backup: {backup_filename}")
-            
-            # Clean up old backups if we have too many
-            cleanup_old_backups()
-            return True
-        else:
-            print(f"[{timestamp}] Backup failed: Token file does not exist")
-            return False
+        # Freeze the ledger at its current event; commands keep mutating while the file is written
+        state = ledger.freeze()
+        log_position = get_log_position()
+        size, checksum = await asyncio.to_thread(write_backup_file, backup_filename, state)
+        
+        manifest = load_backup_manifest()
+        manifest[os.path.basename(backup_filename)] = dict(log_position, seq=state['seq'],
+                                                           events_offset=state['events_offset'],
+                                                           size=size, sha256=checksum)
+        save_backup_manifest(manifest)
+        
+        # Log the backup
+        log_transaction("SYSTEM", "AUTO_BACKUP", amount=timestamp)
+        print(f"[{timestamp}] Created backup: {backup_filename}")
+        
+        # Clean up old backups if we have too many
+        cleanup_old_backups()
+        return True
     except Exception as e:
         print(f"[{timestamp}] Backup failed: {str(e)}")
         return False
@@ -225,52 +1720,410 @@ async def backup_token_data():
 def cleanup_old_backups():
     try:
         # List all backup files and sort by creation time
-        backup_files = [f for f in os.listdir(BACKUP_DIR) if f.startswith("token_data_backup_")]
+        backup_files = [f for f in os.listdir(BACKUP_DIR) if f.startswith("token_data_backup_") and not f.endswith(".tmp")]
         backup_files.sort(key=lambda x: os.path.getctime(os.path.join(BACKUP_DIR, x)), reverse=True)
         
         # Remove excess backups
+        manifest = load_backup_manifest()
         for old_file in backup_files[MAX_BACKUPS:]:
             os.remove(os.path.join(BACKUP_DIR, old_file))
+            manifest.pop(old_file, None)
             print(f"Removed old backup: {old_file}")
+        save_backup_manifest(manifest)
     except Exception as e:
         print(f"Error cleaning up old backups: {str(e)}")
 
+# SHA-256 of a file, read in chunks
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Check that parsed backup data has the {guild_id: {user_id: tokens}} shape
+def validate_backup_balances(data):
+    if not isinstance(data, dict):
+        raise ValueError("backup is not a JSON object")
+    for guild_id, users in data.items():
+        if not guild_id.isdigit() or not isinstance(users, dict):
+            raise ValueError(f"invalid guild entry {guild_id!r}")
+        for user_id, tokens in users.items():
+            if not user_id.isdigit():
+                raise ValueError(f"invalid user id {user_id!r} in guild {guild_id}")
+            if type(tokens) is not int or not 0 <= tokens <= GuildBalances.MAX_TOKENS:
+                raise ValueError(f"invalid token count {tokens!r} for {user_id} in guild {guild_id}")
+    return data
+
+# Read a backup file, checking its size and checksum against the manifest entry before parsing
+def read_verified_backup(backup_filename, manifest_entry):
+    """
+    Raises ValueError describing the first problem found
+    Returns: {guild_id: {user_id: tokens}}
+    """
+    if not os.path.exists(backup_filename):
+        raise ValueError("backup file is missing")
+    if 'size' in manifest_entry and os.path.getsize(backup_filename) != manifest_entry['size']:
+        raise ValueError(f"size is {os.path.getsize(backup_filename)} bytes, expected {manifest_entry['size']} (truncated?)")
+    if 'sha256' in manifest_entry and file_sha256(backup_filename) != manifest_entry['sha256']:
+        raise ValueError("checksum mismatch (file is corrupt)")
+    try:
+        # Backups are gzip-compressed; older ones are plain JSON
+        opener = gzip.open if backup_filename.endswith('.gz') else open
+        with opener(backup_filename, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"not valid JSON: {str(e)}")
+    except (OSError, EOFError) as e:
+        raise ValueError(f"unreadable: {str(e)}")
+    return validate_backup_balances(data)
+
+# Load the balances and grants a backup would restore
+def load_backup_state(backup_filename):
+    """
+    Backups with a known ledger position are rebuilt by replaying the event log up to that
+    point; older backups are read from the file after verification. Runs in a worker thread.
+    Returns: (balances, grants or None)
+    """
+    manifest_entry = load_backup_manifest().get(os.path.basename(backup_filename), {})
+    backup_seq = manifest_entry.get('seq')
+    if backup_seq is not None and backup_seq <= ledger.seq:
+        return ledger.replay(backup_seq)
+    # Plain backup files carry no expiry times, so these tokens will not expire
+    return read_verified_backup(backup_filename, manifest_entry), None
+
 # Restore token data from backup
-def restore_token_data(backup_filename):
+async def restore_token_data(backup_filename):
+    """
+    The backup is loaded and validated off the event loop, then swapped into the resident ledger
+    as a single restore event, so the state before the restore stays recoverable.
+    Raises ValueError if the backup fails validation; nothing is changed in that case
+    """
     try:
-        # Check if backup file exists
-        if os.path.exists(backup_filename):
-            # Create a backup of current file before restore
-            if os.path.exists(TOKEN_FILE):
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                temp_backup = f"{BACKUP_DIR}/pre_restore_backup_{timestamp}.json"
-                shutil.copy2(TOKEN_FILE, temp_backup)
-            
-            # Copy backup to main token file
-            shutil.copy2(backup_filename, TOKEN_FILE)
-            return True
-        else:
-            return False
+        balances, grants = await asyncio.to_thread(load_backup_state, backup_filename)
+        ledger.restore(balances, os.path.basename(backup_filename), grants)
+        return True
+    except ValueError:
+        raise
     except Exception as e:
         print(f"Restore failed: {str(e)}")
         return False
 
+# Per-guild changes a restore would make, without applying it
+async def diff_backup(backup_filename):
+    """
+    Returns: {guild_id: {"added", "removed", "changed", "tokens_before", "tokens_after"}} for
+    guilds whose balances would change
+    Raises ValueError if the backup fails validation
+    """
+    balances, _ = await asyncio.to_thread(load_backup_state, backup_filename)
+    diff = {}
+    for guild_id in set(ledger.balances) | set(balances):
+        before = ledger.get_guild_balances(guild_id)
+        after = balances.get(guild_id, {})
+        stats = {
+            'added': sum(1 for user_id in after if user_id not in before),
+            'removed': sum(1 for user_id in before if user_id not in after),
+            'changed': sum(1 for user_id, tokens in after.items() if user_id in before and before[user_id] != tokens),
+            'tokens_before': sum(before.values()),
+            'tokens_after': sum(after.values()),
+        }
+        if stats['added'] or stats['removed'] or stats['changed']:
+            diff[guild_id] = stats
+    return diff
+
+# Scheduled check of every backup against its recorded checksum
+async def verify_backups():
+    manifest = load_backup_manifest()
+    results = {}
+    for backup in list_available_backups():
+        try:
+            await asyncio.to_thread(read_verified_backup, os.path.join(BACKUP_DIR, backup), manifest.get(backup, {}))
+            results[backup] = None
+        except Exception as e:
+            results[backup] = str(e)
+            print(f"Backup {backup} failed verification: {str(e)}")
+
+    # Re-read the manifest in case a backup was written while verifying
+    manifest = load_backup_manifest()
+    verified_at = datetime.datetime.now().strftime(LOG_TIMESTAMP_FORMAT)
+    for backup, error in results.items():
+        if os.path.exists(os.path.join(BACKUP_DIR, backup)):
+            manifest.setdefault(backup, {}).update(verified_at=verified_at, verify_error=error)
+    save_backup_manifest(manifest)
+
+    failures = sum(1 for error in results.values() if error)
+    if failures:
+        raise RuntimeError(f"{failures} backup(s) failed verification")
+
 # List available backups
 def list_available_backups():
     try:
-        backup_files = [f for f in os.listdir(BACKUP_DIR) if f.startswith("token_data_backup_")]
+        backup_files = [f for f in os.listdir(BACKUP_DIR) if f.startswith("token_data_backup_") and not f.endswith(".tmp")]
         backup_files.sort(key=lambda x: os.path.getctime(os.path.join(BACKUP_DIR, x)), reverse=True)
         return backup_files
     except Exception as e:
         print(f"Error listing backups: {str(e)}")
         return []
 
-# Automatic backup task
-async def automatic_backup_task():
-    await bot.wait_until_ready()
-    while not bot.is_closed():
-        await backup_token_data()
-        await asyncio.sleep(BACKUP_INTERVAL)  # Wait for the interval period
+# Write the daily rollups and audit counters to disk
+def flush_logs():
+    flush_rollups()
+    flush_audit_counters()
+
+# Remove tokens of members who left while the bot was not watching
+async def reconcile_departed_members():
+    """
+    on_member_remove misses departures during downtime or reconnects. Only guilds whose member
+    list is fully cached are checked, so a partial cache never looks like a departure.
+    """
+    for guild in bot.guilds:
+        if not guild.chunked:
+            continue
+        balances = await ledger_client.call('get_guild_balances', guild.id)
+        departed = {user_id: tokens for user_id, tokens in balances.items() if guild.get_member(int(user_id)) is None}
+        if not departed:
+            continue
+
+        await ledger_client.call('apply_changes', guild.id,
+                                 {user_id: -tokens for user_id, tokens in departed.items()}, "AUTO_REMOVE_LEFT_MEMBER")
+        log_transactions([(guild, "AUTO_REMOVE_LEFT_MEMBER", None,
+                           bot.get_user(int(user_id)) or f"<@{user_id}>", tokens)
+                          for user_id, tokens in departed.items()])
+        print(f"Removed tokens of {len(departed)} departed member(s) in {guild.name}")
+
+# Periodic jobs run by the scheduler:
+# {name: {interval, func, jitter, next_run, task, runs, failures, skipped, last_run, last_duration, last_error}}
+scheduled_jobs = {}
+scheduler_task = None
+
+# Register a job to run every interval seconds
+def schedule_job(name, interval, func, jitter=SCHEDULER_JITTER):
+    scheduled_jobs[name] = {
+        'interval': interval, 'func': func, 'jitter': min(jitter, interval / 10),
+        'next_run': None, 'task': None,
+        'runs': 0, 'failures': 0, 'skipped': 0,
+        'last_run': None, 'last_duration': None, 'last_error': None,
+    }
+
+# Start of the next interval slot on the wall clock, plus jitter
+def next_aligned_run(job, now):
+    """
+    Slots are multiples of the interval since the epoch (daily backups run just after midnight
+    UTC), so runs do not drift with how long each one takes or when the process started
+    """
+    return (math.floor(now / job['interval']) + 1) * job['interval'] + random.uniform(0, job['jitter'])
+
+# Run one job and record its metrics
+async def run_scheduled_job(name):
+    job = scheduled_jobs[name]
+    started = time.time()
+    job['last_run'] = started
+    try:
+        result = job['func']()
+        if inspect.isawaitable(result):
+            result = await result
+        if result is False:
+            raise RuntimeError("job reported failure")
+        job['runs'] += 1
+        job['last_error'] = None
+    except Exception as e:
+        job['failures'] += 1
+        job['last_error'] = str(e)
+        print(f"Error in scheduled job {name}: {str(e)}")
+    finally:
+        job['last_duration'] = time.time() - started
+
+# Single loop that starts every scheduled job in its slot
+async def run_scheduler():
+    now = time.time()
+    for job in scheduled_jobs.values():
+        job['next_run'] = next_aligned_run(job, now)
+
+    while True:
+        next_run = min(job['next_run'] for job in scheduled_jobs.values())
+        delay = next_run - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        now = time.time()
+        for name, job in scheduled_jobs.items():
+            if job['next_run'] > now:
+                continue
+            if job['task'] is not None and not job['task'].done():
+                # Still running from the previous slot; never run a job twice at once
+                job['skipped'] += 1
+            else:
+                job['task'] = asyncio.get_running_loop().create_task(run_scheduled_job(name))
+            # Slots missed while the process was suspended are skipped, not caught up
+            job['next_run'] = next_aligned_run(job, now)
+
+# Start the scheduler once per process
+def start_scheduler():
+    global scheduler_task
+    if scheduler_task is None and scheduled_jobs:
+        scheduler_task = asyncio.get_running_loop().create_task(run_scheduler())
+        print(f"Scheduler started: {', '.join(scheduled_jobs)}")
+
+# Scheduler metrics for reporting, without the callables
+def get_job_metrics():
+    return {name: {key: value for key, value in job.items() if key not in ('func', 'task')}
+            | {'running': job['task'] is not None and not job['task'].done()}
+            for name, job in list(scheduled_jobs.items())}
+
+# Expiry time for tokens given now, or None when tokens do not expire
+def token_expiry_timestamp():
+    if not TOKEN_EXPIRY_DAYS:
+        return None
+    return int(time.time() + TOKEN_EXPIRY_DAYS * 24 * 60 * 60)
+
+# Log expired tokens with one append
+def log_expired_tokens(expired):
+    """
+    expired: {guild_id: {user_id: tokens}} as returned by TokenLedger.expire_due
+    Names come from the gateway cache; the coordinator has none, so it uses the guild name
+    recorded with the grant and logs members by id
+    """
+    transactions = []
+    for guild_id, users in expired.items():
+        guild = bot.get_guild(int(guild_id))
+        for user_id, amount in users.items():
+            member = guild.get_member(int(user_id)) if guild else None
+            transactions.append((guild or ledger.guild_names.get(guild_id, guild_id), "TOKEN_EXPIRED", None,
+                                 member or f"<@{user_id}>", amount))
+    log_transactions(transactions)
+
+# Expire tokens as their grants come due, sleeping until the next expiry in between
+async def token_expiry_task():
+    ledger.expiry_wakeup = asyncio.Event()
+    while True:
+        try:
+            # Cleared before reading the heap, so a grant added meanwhile still wakes us
+            ledger.expiry_wakeup.clear()
+            now = time.time()
+            next_expiry = ledger.next_expiry()
+            if next_expiry is not None and next_expiry <= now:
+                expired = ledger.expire_due(now)
+                if expired:
+                    log_expired_tokens(expired)
+                    print(f"Expired tokens of {sum(len(users) for users in expired.values())} member(s)")
+                continue
+
+            timeout = MAX_EXPIRY_WAIT if next_expiry is None else min(next_expiry - now, MAX_EXPIRY_WAIT)
+            try:
+                await asyncio.wait_for(ledger.expiry_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        except Exception as e:
+            print(f"Error expiring tokens: {str(e)}")
+            await asyncio.sleep(MAX_EXPIRY_WAIT)
+
+# Discord REST call metrics: {command_name: {route: {calls, errors, rate_limited, latency, max_latency, rate_limit_wait}}}
+# Calls made outside a slash command (sync, background tasks) are recorded under BACKGROUND_COMMAND
+BACKGROUND_COMMAND = '(background)'
+rest_metrics = {}
+rest_metrics_lock = Lock()  # The web server reads the metrics from its own thread
+current_command = contextvars.ContextVar('current_command', default=BACKGROUND_COMMAND)
+# Timing of the REST call in flight: {"mark", "waiting", "rate_limit_wait", "rate_limited"}
+current_rest_call = contextvars.ContextVar('current_rest_call', default=None)
+
+# Metrics bucket for a command and route
+def get_rest_route_stats(command_name, route_key):
+    return rest_metrics.setdefault(command_name, {}).setdefault(route_key, {
+        'calls': 0, 'errors': 0, 'rate_limited': 0, 'latency': 0.0, 'max_latency': 0.0, 'rate_limit_wait': 0.0})
+
+# Record one finished REST call
+def record_rest_call(route_key, elapsed, status=None, rate_limit_wait=0.0, rate_limited=0):
+    with rest_metrics_lock:
+        stats = get_rest_route_stats(current_command.get(), route_key)
+        stats['calls'] += 1
+        stats['latency'] += elapsed
+        stats['max_latency'] = max(stats['max_latency'], elapsed)
+        stats['rate_limit_wait'] += rate_limit_wait
+        stats['rate_limited'] += rate_limited
+        if status is not None:
+            stats['errors'] += 1
+
+# Copy of the metrics with average latency, safe to serialize
+def get_rest_metrics():
+    with rest_metrics_lock:
+        snapshot = {}
+        for command_name, routes in rest_metrics.items():
+            snapshot[command_name] = {}
+            for route_key, stats in routes.items():
+                route_stats = dict(stats)
+                route_stats['avg_latency'] = stats['latency'] / stats['calls'] if stats['calls'] else 0.0
+                snapshot[command_name][route_key] = route_stats
+        return snapshot
+
+# An HTTP send starts: the time since the call started, or since a 429, was spent in rate limits
+async def on_rest_request_start(session, context, params):
+    call = current_rest_call.get()
+    if call is not None and call['waiting']:
+        call['rate_limit_wait'] += time.perf_counter() - call['mark']
+
+# An HTTP send got its response; discord.py sleeps and resends after a 429
+async def on_rest_request_end(session, context, params):
+    call = current_rest_call.get()
+    if call is not None:
+        call['mark'] = time.perf_counter()
+        call['waiting'] = params.response.status == 429
+        if call['waiting']:
+            call['rate_limited'] += 1
+
+# An HTTP send failed; the delay before discord.py retries is not a rate limit
+async def on_rest_request_exception(session, context, params):
+    call = current_rest_call.get()
+    if call is not None:
+        call['waiting'] = False
+
+# Wrap a coroutine REST method so every call is timed and attributed to the current command
+def instrument_rest_method(request, route_index):
+    async def instrumented_request(*args, **kwargs):
+        route = args[route_index]
+        route_key = f"{route.method} {route.path}"
+        start = time.perf_counter()
+        # Bucket waits happen between here and the first send
+        call = {'mark': start, 'waiting': True, 'rate_limit_wait': 0.0, 'rate_limited': 0}
+        call_token = current_rest_call.set(call)
+        status = None
+        try:
+            return await request(*args, **kwargs)
+        except discord.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            current_rest_call.reset(call_token)
+            record_rest_call(route_key, time.perf_counter() - start, status,
+                             call['rate_limit_wait'], call['rate_limited'])
+    return instrumented_request
+
+# Remember which slash command an interaction runs, for REST attribution
+async def track_interaction_command(interaction):
+    current_command.set(interaction.command.name if interaction.command else BACKGROUND_COMMAND)
+    return True
+
+# Hook the bot's HTTP client and the interaction/webhook adapter
+def install_rest_instrumentation():
+    # bot.http.request(route, ...) covers fetch_member, tree.sync and other bot API calls
+    bot.http.request = instrument_rest_method(bot.http.request, 0)
+
+    # Interaction responses and followups go through the webhook adapter: request(self, route, ...)
+    adapter_cls = discord.webhook.async_.AsyncWebhookAdapter
+    adapter_cls.request = instrument_rest_method(adapter_cls.request, 1)
+
+    # Interactions send through the bot's HTTP session too, so one trace sees every send
+    rest_trace.on_request_start.append(on_rest_request_start)
+    rest_trace.on_request_end.append(on_rest_request_end)
+    rest_trace.on_request_exception.append(on_rest_request_exception)
+
+    # The interaction check runs in the same task as the command, so the context variable carries over
+    bot.tree.interaction_check = track_interaction_command
+
+install_rest_instrumentation()
+
+# Set in the ledger coordinator, which serves the web server but runs no bot
+is_coordinator = False
 
 # Add a Flask web server
 app = Flask(__name__)
@@ -279,6 +2132,119 @@ app = Flask(__name__)
 def home():
     return "Discord bot is running!"
 
+# Discord REST metrics as JSON
+@app.route('/metrics/rest')
+def rest_metrics_endpoint():
+    if is_coordinator:
+        return jsonify(error="REST metrics are kept by each bot process, see /rest_stats"), 404
+    return {'commands': get_rest_metrics()}
+
+# Scheduled job metrics as JSON
+@app.route('/metrics/jobs')
+def job_metrics_endpoint():
+    return {'jobs': get_job_metrics()}
+
+# Notification pipeline counters as JSON
+@app.route('/metrics/notifications')
+def notification_metrics_endpoint():
+    if is_coordinator:
+        return jsonify(error="notification metrics are kept by each bot process"), 404
+    return dict(notify_stats, pending=notify_queue.qsize() if notify_queue is not None else 0)
+
+# Ledger memory use per guild as JSON (served by the process that owns the ledger)
+@app.route('/metrics/ledger')
+def ledger_metrics_endpoint():
+    return {'seq': ledger.seq, 'guilds': read_on_ledger_loop(ledger.memory_report)}
+
+# Serialized guild balances for the API: {guild_id: (version, body)}, least recently used first
+api_cache = collections.OrderedDict()
+api_cache_lock = Lock()
+
+# Event loop of the process that owns the ledger, set once it runs
+ledger_loop = None
+
+# Run a ledger read from the web server thread on the loop that mutates the ledger
+def read_on_ledger_loop(func, *args):
+    """
+    GuildBalances changes are not atomic across its two arrays, so the web server thread must
+    not read them while an event is being applied
+    """
+    if ledger_loop is None or not ledger_loop.is_running():
+        return func(*args)
+
+    async def read():
+        return func(*args)
+    return asyncio.run_coroutine_threadsafe(read(), ledger_loop).result(timeout=API_READ_TIMEOUT)
+
+# A guild's version and balances, read together
+def read_guild_balances(guild_id):
+    """
+    Returns: (version, {user_id: tokens})
+    """
+    return ledger.guild_version(guild_id), ledger.get_guild_balances(guild_id)
+
+# Check the API key when one is configured
+def balances_api_authorized():
+    return not BALANCES_API_KEY or request.headers.get('Authorization') == f"Bearer {BALANCES_API_KEY}"
+
+# Build a response with an ETag for a ledger version, or 304 when the client already has it
+def versioned_response(etag_prefix, version, build_body):
+    """
+    build_body() returns (version, body); the body's own version goes into the ETag
+    """
+    etag = f"{etag_prefix}-{version}"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        body_version, body = build_body()
+        etag = f"{etag_prefix}-{body_version}"
+        response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f"max-age={API_CACHE_SECONDS}"
+    return response
+
+# All balances of a guild as JSON (served by the process that owns the ledger)
+@app.route('/api/guilds/<int:guild_id>/balances')
+def guild_balances_endpoint(guild_id):
+    if not balances_api_authorized():
+        return jsonify(error="unauthorized"), 401
+
+    version = ledger.guild_version(guild_id)
+
+    # Serialize once per ledger version; unchanged polls reuse the cached body
+    def build_body():
+        with api_cache_lock:
+            cached = api_cache.get(guild_id)
+            if cached is not None and cached[0] == version:
+                api_cache.move_to_end(guild_id)
+                return cached
+        body_version, balances = read_on_ledger_loop(read_guild_balances, guild_id)
+        body = json.dumps({'guild_id': str(guild_id), 'version': body_version,
+                           'holders': len(balances), 'balances': balances})
+        with api_cache_lock:
+            api_cache[guild_id] = (body_version, body)
+            api_cache.move_to_end(guild_id)
+            while len(api_cache) > API_CACHE_MAX_GUILDS:
+                api_cache.popitem(last=False)
+        return body_version, body
+
+    return versioned_response(str(guild_id), version, build_body)
+
+# Balance of one member as JSON
+@app.route('/api/guilds/<int:guild_id>/balances/<int:user_id>')
+def user_balance_endpoint(guild_id, user_id):
+    if not balances_api_authorized():
+        return jsonify(error="unauthorized"), 401
+
+    # Read the version and the balance together on the ledger's loop
+    def build_body():
+        body_version, tokens = read_on_ledger_loop(
+            lambda: (ledger.guild_version(guild_id), ledger.get_balance(guild_id, user_id)))
+        return body_version, json.dumps({'guild_id': str(guild_id), 'user_id': str(user_id),
+                                         'version': body_version, 'tokens': tokens})
+
+    return versioned_response(f"{guild_id}-{user_id}", ledger.guild_version(guild_id), build_body)
+
 def run_server():
     try:
         port = int(os.environ.get("PORT", 10000))
@@ -286,35 +2252,49 @@ def run_server():
     except Exception as e:
         print(f"Web server error: {str(e)}")
 
-# Keep the application alive by pinging it regularly
+# HTTP session shared by background jobs
+http_session = None
+
+def get_http_session():
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+    return http_session
+
+# Keep the application alive by pinging it
 async def keep_alive():
-    await bot.wait_until_ready()
-    while not bot.is_closed():
-        try:
-            # Get your app URL from environment variable or use a default one
-            app_url = os.environ.get("APP_URL", "https://discord-bot-app-7ibw.onrender.com")
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{app_url}/") as resp:
-                    if resp.status == 200:
-                        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Kept app alive with ping")
-        except Exception as e:
-            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Failed to ping: {e}")
-        await asyncio.sleep(2 * 60)  # Ping every 2 minutes
+    # Get your app URL from environment variable or use a default one
+    app_url = os.environ.get("APP_URL", "https://discord-bot-app-7ibw.onrender.com")
+    async with get_http_session().get(f"{app_url}/") as resp:
+        if resp.status != 200:
+            raise RuntimeError(f"ping returned HTTP {resp.status}")
+        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Kept app alive with ping")
 
 @bot.event
 async def on_ready():
+    global ledger_loop
     print(f'Bot is online as {bot.user.name}')
+    if not LEDGER_SOCKET:
+        ledger_loop = asyncio.get_running_loop()
     try:
-        synced = await bot.tree.sync()
-        print(f"Synced {len(synced)} command(s)")
+        # Commands are global, so only one process of a sharded deployment needs to sync them
+        if not SHARD_IDS or 0 in SHARD_IDS:
+            synced = await bot.tree.sync()
+            print(f"Synced {len(synced)} command(s)")
         
-        # Start automatic backup task
-        bot.loop.create_task(automatic_backup_task())
-        print("Automatic backup system initialized")
-        
-        # Add the keep alive task
-        bot.loop.create_task(keep_alive())
-        print("Keep alive system initialized")
+        # Background jobs start once; on_ready also fires after every reconnect
+        if scheduler_task is None:
+            if not LEDGER_SOCKET:
+                # In sharded mode these run in the ledger coordinator
+                schedule_job("backup", BACKUP_INTERVAL, backup_token_data)
+                schedule_job("verify_backups", BACKUP_VERIFY_INTERVAL, verify_backups)
+                schedule_job("log_flush", ROLLUP_FLUSH_INTERVAL, flush_logs)
+                schedule_job("keep_alive", KEEP_ALIVE_INTERVAL, keep_alive)
+                bot.loop.create_task(token_expiry_task())
+                print("Token expiry system initialized")
+            schedule_job("reconcile", RECONCILE_INTERVAL, reconcile_departed_members)
+            start_scheduler()
+            start_notification_worker()
     except Exception as e:
         print(f"Failed to sync commands: {e}")
 
@@ -323,21 +2303,16 @@ async def on_ready():
 async def on_member_remove(member):
     """Automatically remove tokens when a member leaves the server"""
     try:
-        # Load token data
-        token_data = load_token_data()
         guild_id = str(member.guild.id)
         user_id = str(member.id)
         
         # Check if user had tokens
-        if guild_id in token_data and user_id in token_data[guild_id]:
-            removed_tokens = token_data[guild_id][user_id]
-            del token_data[guild_id][user_id]
-            
-            # Save the updated data
-            save_token_data(token_data)
+        removed_tokens = await ledger_client.call('get_balance', guild_id, user_id)
+        if removed_tokens > 0:
+            await ledger_client.call('apply_changes', guild_id, {user_id: -removed_tokens}, "AUTO_REMOVE_LEFT_MEMBER")
             
             # Log the automatic removal
-            log_transaction(member.guild.name, 
+            log_transaction(member.guild, 
                           "AUTO_REMOVE_LEFT_MEMBER", 
                           member=member, 
                           amount=removed_tokens)
@@ -355,12 +2330,12 @@ async def create_backup(interaction: discord.Interaction):
         return
     
     # Execute backup
-    success = await backup_token_data()
+    success = await ledger_client.call('backup_token_data')
     
     if success:
         # Log transaction
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_transaction(interaction.guild.name, "MANUAL_BACKUP", interaction.user)
+        log_transaction(interaction.guild, "MANUAL_BACKUP", interaction.user)
         
         await interaction.response.send_message(f"✅ Backup created successfully at {timestamp}", ephemeral=True)
     else:
@@ -379,6 +2354,8 @@ async def list_backups(interaction: discord.Interaction):
         await interaction.response.send_message("No backups available.", ephemeral=True)
         return
     
+    manifest = load_backup_manifest()
+    
     # Create an embed for backups
     embed = discord.Embed(
         title="Available Backups",
@@ -395,14 +2372,23 @@ async def list_backups(interaction: discord.Interaction):
         # Get file size
         size_kb = os.path.getsize(backup_path) / 1024
         
+        # Result of the last background verification
+        entry = manifest.get(backup, {})
+        if entry.get('verify_error'):
+            status = f"❌ Failed verification: {entry['verify_error']}"
+        elif entry.get('verified_at'):
+            status = f"✅ Verified {entry['verified_at']}"
+        else:
+            status = "Not verified yet"
+        
         embed.add_field(
             name=f"{i+1}. {backup}",
-            value=f"Created: {formatted_time}\nSize: {size_kb:.2f} KB",
+            value=f"Created: {formatted_time}\nSize: {size_kb:.2f} KB\n{status}",
             inline=False
         )
     
     # Log transaction
-    log_transaction(interaction.guild.name, "LIST_BACKUPS", interaction.user)
+    log_audit_event(interaction.guild.name, "LIST_BACKUPS", interaction.user)
     
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
@@ -414,21 +2400,10 @@ async def list_backups(interaction: discord.Interaction):
 async def verify_balance(interaction: discord.Interaction, user1: discord.Member, user2: discord.Member):
     await interaction.response.defer(ephemeral=False)
     
-    # Load token data
-    token_data = load_token_data()
-    guild_id = str(interaction.guild_id)
-    user1_id = str(user1.id)
-    user2_id = str(user2.id)
-
-    # Get token counts for both users
-    user1_tokens = 0
-    user2_tokens = 0
-    
-    if guild_id in token_data:
-        if user1_id in token_data[guild_id]:
-            user1_tokens = token_data[guild_id][user1_id]
-        if user2_id in token_data[guild_id]:
-            user2_tokens = token_data[guild_id][user2_id]
+    # Get token counts for both users in one lookup
+    balances = await ledger_client.call('get_balances', interaction.guild_id, [user1.id, user2.id])
+    user1_tokens = balances[str(user1.id)]
+    user2_tokens = balances[str(user2.id)]
 
     # Create a simple verification embed
     embed = discord.Embed(
@@ -471,7 +2446,7 @@ async def verify_balance(interaction: discord.Interaction, user1: discord.Member
     embed.timestamp = discord.utils.utcnow()
 
     # Log transaction
-    log_transaction(
+    log_audit_event(
         interaction.guild.name, 
         "VERIFY_BALANCE", 
         admin=interaction.user, 
@@ -480,6 +2455,88 @@ async def verify_balance(interaction: discord.Interaction, user1: discord.Member
 
     await interaction.followup.send(embed=embed)
 
+# Split lines into embed field values under Discord's 1024 character limit
+def chunk_field_lines(lines, limit=1024):
+    chunks = []
+    current = ""
+    for line in lines:
+        if current and len(current) + len(line) + 1 > limit:
+            chunks.append(current)
+            current = ""
+        current += line + "\n"
+    if current:
+        chunks.append(current)
+    return chunks
+
+@bot.tree.command(name="verify-team", description="Check that every player in a team has enough tokens")
+@app_commands.describe(
+    role="Check every member with this role",
+    members="Players to check (mentions or IDs)",
+    required="Tokens each player needs (default: 1)"
+)
+async def verify_team(interaction: discord.Interaction, role: discord.Role = None,
+                      members: str = None, required: int = 1):
+    await interaction.response.defer(ephemeral=False)
+
+    # Players and their display names come from the member cache
+    players, unresolved = resolve_bulk_members(interaction.guild, role, members)
+    if not players:
+        await interaction.followup.send("❌ No players to verify. Pick a role or list members.")
+        return
+
+    required = max(required, 1)
+
+    # All balances in one ledger lookup
+    balances = await ledger_client.call('get_balances', interaction.guild_id, [player.id for player in players])
+
+    players.sort(key=lambda player: player.display_name.lower())
+    short = [player for player in players if balances[str(player.id)] < required]
+
+    embed = discord.Embed(
+        title="⚖️ Team Token Verification",
+        color=discord.Color.green() if not short else discord.Color.red()
+    )
+
+    # Short players are listed first; the list stops at VERIFY_TEAM_LIST_CHARS to stay within
+    # Discord's 6000 character embed limit, and the rest are counted
+    balance_lines = []
+    listed_length = 0
+    ordered = short + [player for player in players if balances[str(player.id)] >= required]
+    for player in ordered:
+        tokens = balances[str(player.id)]
+        status = "✅" if tokens >= required else "❌"
+        line = f"{status} **{player.display_name}** - {tokens} token{'s' if tokens != 1 else ''}"
+        if listed_length + len(line) + 1 > VERIFY_TEAM_LIST_CHARS:
+            break
+        balance_lines.append(line)
+        listed_length += len(line) + 1
+    if len(balance_lines) < len(ordered):
+        balance_lines.append(f"...and {len(ordered) - len(balance_lines)} more player(s)")
+    for i, chunk in enumerate(chunk_field_lines(balance_lines)):
+        embed.add_field(name="Token Balances" if i == 0 else "Token Balances (cont.)", value=chunk, inline=False)
+
+    if not short:
+        verification_text = f"✅ All {len(players)} players have enough tokens to proceed"
+    else:
+        verification_text = (f"❌ {format_member_list(short)} "
+                             f"{'does' if len(short) == 1 else 'do'} not hold enough tokens to proceed")
+    if unresolved:
+        verification_text += f"\n⚠️ {len(unresolved)} listed user(s) are not in this server"
+
+    embed.add_field(name="Verification", value=verification_text[:1024], inline=False)
+
+    embed.set_footer(text=f"Verified by {interaction.user.display_name} • {required} token(s) required")
+    embed.timestamp = discord.utils.utcnow()
+
+    log_audit_event(
+        interaction.guild.name,
+        "VERIFY_TEAM",
+        admin=interaction.user,
+        member=f"{len(players)} players"
+    )
+
+    await interaction.followup.send(embed=embed)
+
 # Command to restore from backup (Admin only)
 @bot.tree.command(name="restore_backup", description="Restore token data from a backup (Admin only)")
 @app_commands.describe(backup_number="Backup number from list_backups command")
@@ -501,12 +2558,42 @@ async def restore_backup(interaction: discord.Interaction, backup_number: int):
     # Get the backup file path
     backup_filename = os.path.join(BACKUP_DIR, backups[backup_number-1])
     
-    # Confirm restoration
-    await interaction.response.send_message(
-        f"⚠️ Are you sure you want to restore from backup: {backups[backup_number-1]}?\n"
-        f"This will overwrite the current token data. Type `/confirm_restore {backup_number}` to proceed.",
-        ephemeral=True
+    await interaction.response.defer(ephemeral=True)
+    
+    # Dry run: validate the backup and show what it would change
+    try:
+        diff = await ledger_client.call('diff_backup', backup_filename)
+    except ValueError as e:
+        await interaction.followup.send(f"❌ Backup {backups[backup_number-1]} cannot be restored: {str(e)}", ephemeral=True)
+        return
+    
+    if not diff:
+        await interaction.followup.send(
+            f"Backup {backups[backup_number-1]} matches the current balances; restoring it would change nothing.",
+            ephemeral=True)
+        return
+    
+    embed = discord.Embed(
+        title=f"Restore preview: {backups[backup_number-1]}",
+        description=(f"Restoring replaces the balances of **all** servers. {len(diff)} server(s) would change.\n"
+                     f"Use `/confirm_restore {backup_number}` to proceed."),
+        color=discord.Color.orange()
     )
+    # This server first, then the servers with the most changes
+    ordered = sorted(diff.items(), key=lambda item: (item[0] != str(interaction.guild_id),
+                                                     -(item[1]['added'] + item[1]['removed'] + item[1]['changed'])))
+    for guild_id, stats in ordered[:10]:
+        guild = bot.get_guild(int(guild_id))
+        embed.add_field(
+            name=guild.name if guild else f"Server {guild_id}",
+            value=(f"Tokens: {stats['tokens_before']} → {stats['tokens_after']}\n"
+                   f"{stats['changed']} changed, {stats['added']} added, {stats['removed']} cleared"),
+            inline=False
+        )
+    if len(diff) > 10:
+        embed.set_footer(text=f"...and {len(diff) - 10} more server(s)")
+    
+    await interaction.followup.send(embed=embed, ephemeral=True)
 
 # Command to confirm restoration (Admin only)
 @bot.tree.command(name="confirm_restore", description="Confirm restoration from backup (Admin only)")
@@ -525,16 +2612,23 @@ async def confirm_restore(interaction: discord.Interaction, backup_number: int):
     # Get the backup file path
     backup_filename = os.path.join(BACKUP_DIR, backups[backup_number-1])
     
+    # Replaying the event log can take longer than Discord's 3 second response window
+    await interaction.response.defer(ephemeral=True)
+    
     # Perform the restore
-    success = restore_token_data(backup_filename)
+    try:
+        success = await ledger_client.call('restore_token_data', backup_filename)
+    except ValueError as e:
+        await interaction.followup.send(f"❌ Backup failed validation and was not restored: {str(e)}", ephemeral=True)
+        return
     
     if success:
         # Log transaction
-        log_transaction(interaction.guild.name, "RESTORE_BACKUP", interaction.user, amount=backups[backup_number-1])
+        log_transaction(interaction.guild, "RESTORE_BACKUP", interaction.user, amount=backups[backup_number-1])
         
-        await interaction.response.send_message(f"✅ Successfully restored token data from backup: {backups[backup_number-1]}", ephemeral=True)
+        await interaction.followup.send(f"✅ Successfully restored token data from backup: {backups[backup_number-1]}", ephemeral=True)
     else:
-        await interaction.response.send_message("❌ Failed to restore from backup. Check server logs for details.", ephemeral=True)
+        await interaction.followup.send("❌ Failed to restore from backup. Check server logs for details.", ephemeral=True)
 
 # Nytt kommando för att kolla andra användares balans
 @bot.tree.command(name="check_user_balance", description="Check another user's token balance")
@@ -542,15 +2636,8 @@ async def confirm_restore(interaction: discord.Interaction, backup_number: int):
 async def check_user_balance(interaction: discord.Interaction, member: discord.Member):
     await interaction.response.defer(ephemeral=False)
     
-    # Load token data
-    token_data = load_token_data()
-    guild_id = str(interaction.guild_id)
-    user_id = str(member.id)
-
     # Get token count
-    tokens = 0
-    if guild_id in token_data and user_id in token_data[guild_id]:
-        tokens = token_data[guild_id][user_id]
+    tokens = await ledger_client.call('get_balance', interaction.guild_id, member.id)
 
     # Create a nice embed for checking other users
     embed = discord.Embed(
@@ -573,8 +2660,8 @@ async def check_user_balance(interaction: discord.Interaction, member: discord.M
     embed.timestamp = discord.utils.utcnow()
 
     # Log transaction
-    log_transaction(interaction.guild.name, "CHECK_USER_BALANCE", 
-                   admin=interaction.user, member=member)
+    log_audit_event(interaction.guild.name, "CHECK_USER_BALANCE", 
+                    admin=interaction.user, member=member)
 
     await interaction.followup.send(embed=embed)
 # Command to give tokens to a user (Admin only)
@@ -595,17 +2682,8 @@ async def give_tokens(interaction: discord.Interaction, member: discord.Member,
         await interaction.followup.send("❌ You can only give 1-3 tokens at a time.")
         return
 
-    # Load token data
-    token_data = load_token_data()
-    guild_id = str(interaction.guild_id)
-    user_id = str(member.id)
-
-    # Initialize guild data if not exists
-    if guild_id not in token_data:
-        token_data[guild_id] = {}
-
-    # Update token count
-    current_tokens = token_data[guild_id].get(user_id, 0)
+    # Get current token count
+    current_tokens = await ledger_client.call('get_balance', interaction.guild_id, member.id)
     
     # Check if adding tokens would exceed the maximum
     if current_tokens + amount > MAX_TOKENS_PER_USER:
@@ -614,18 +2692,22 @@ async def give_tokens(interaction: discord.Interaction, member: discord.Member,
         )
         return
 
-    # Update token count
-    token_data[guild_id][user_id] = current_tokens + amount
-
-    # Save token data
-    save_token_data(token_data)
+    # Update token count; the cap is checked again with the change, in case a concurrent command got there first
+    try:
+        new_balances = await ledger_client.call('apply_changes', interaction.guild_id, {member.id: amount}, "GIVE_TOKENS",
+                                                MAX_TOKENS_PER_USER, token_expiry_timestamp(), interaction.guild.name)
+    except ValueError:
+        await interaction.followup.send(
+            f"❌ Cannot give {amount} token(s) to {member.mention}: their balance changed and would now exceed the maximum of {MAX_TOKENS_PER_USER}."
+        )
+        return
 
     # Log transaction
-    log_transaction(interaction.guild.name, "GIVE_TOKENS", interaction.user,
+    log_transaction(interaction.guild, "GIVE_TOKENS", interaction.user,
                     member, amount)
 
     await interaction.followup.send(
-        f"✅ Successfully gave {amount} token(s) to {member.mention}. They now have {token_data[guild_id][user_id]} token(s)."
+        f"✅ Successfully gave {amount} token(s) to {member.mention}. They now have {new_balances[str(member.id)]} token(s)."
     )
 
 # Command to deposit tokens into the BO7 Bank
@@ -636,13 +2718,11 @@ async def deposit_tokens(interaction: discord.Interaction, amount: int):
     # Defer the response without making it ephemeral
     await interaction.response.defer(ephemeral=False)
     
-    # Load token data
-    token_data = load_token_data()
-    guild_id = str(interaction.guild_id)
     user_id = str(interaction.user.id)
+    current_tokens = await ledger_client.call('get_balance', interaction.guild_id, user_id)
 
     # Check if user has enough tokens
-    if guild_id not in token_data or user_id not in token_data[guild_id] or token_data[guild_id][user_id] < amount:
+    if current_tokens == 0 or current_tokens < amount:
         await interaction.followup.send(
             f"❌ {interaction.user.mention} doesn't have enough tokens to deposit.")
         return
@@ -652,23 +2732,21 @@ async def deposit_tokens(interaction: discord.Interaction, amount: int):
             "❌ You must deposit at least 1 token.")
         return
 
-    # Update token count
-    token_data[guild_id][user_id] -= amount
-
-    # Remove user from data if they have 0 tokens
-    if token_data[guild_id][user_id] == 0:
-        del token_data[guild_id][user_id]
-
-    # Save token data
-    save_token_data(token_data)
+    # Update token count (users with 0 tokens are dropped from the ledger)
+    try:
+        new_balances = await ledger_client.call('apply_changes', interaction.guild_id, {user_id: -amount}, "DEPOSIT_TOKENS")
+    except ValueError:
+        await interaction.followup.send(
+            f"❌ {interaction.user.mention} doesn't have enough tokens to deposit.")
+        return
 
     # Log transaction
-    log_transaction(interaction.guild.name,
+    log_transaction(interaction.guild,
                     "DEPOSIT_TOKENS",
                     member=interaction.user,
                     amount=amount)
 
-    remaining = token_data[guild_id].get(user_id, 0)
+    remaining = new_balances[user_id]
     await interaction.followup.send(
         f"🏦 {interaction.user.mention} has deposited {amount} token(s) into the BO7 Bank. They now have {remaining} token(s) remaining."
     )
@@ -680,11 +2758,10 @@ async def check_balances(interaction: discord.Interaction):
     # Defer the response
     await interaction.response.defer(ephemeral=False)
     
-    # Load token data
-    token_data = load_token_data()
-    guild_id = str(interaction.guild_id)
+    # Get the guild's balances
+    guild_balances = await ledger_client.call('get_guild_balances', interaction.guild_id)
 
-    if guild_id not in token_data or not token_data[guild_id]:
+    if not guild_balances:
         # Create a nice "empty" embed
         embed = discord.Embed(
             title="💰 Token Balances",
@@ -701,7 +2778,7 @@ async def check_balances(interaction: discord.Interaction):
         color=discord.Color.from_rgb(70, 130, 180))  # Steel blue color
 
     # Get all members with tokens (sorted alphabetically for fairness)
-    sorted_users = sorted(token_data[guild_id].items(),
+    sorted_users = sorted(guild_balances.items(),
                           key=lambda x: x[0])  # Sort by user ID (neutral)
 
     # Create the member list
@@ -742,7 +2819,7 @@ async def check_balances(interaction: discord.Interaction):
     embed.timestamp = discord.utils.utcnow()
 
     # Log transaction
-    log_transaction(interaction.guild.name,
+    log_audit_event(interaction.guild.name,
                     "CHECK_BALANCES",
                     member=interaction.user)
 
@@ -751,25 +2828,43 @@ async def check_balances(interaction: discord.Interaction):
    # Admin command to check user's total token history
 @bot.tree.command(name="user_tokens", 
                   description="Check a user's complete token history (Admin only)")
-@app_commands.describe(member="The member to check token history for")
-async def check_user_tokens(interaction: discord.Interaction, member: discord.Member):
+@app_commands.describe(member="The member to check token history for",
+                       days="Only include the last N days",
+                       start_date="Only include activity from this date (YYYY-MM-DD)",
+                       end_date="Only include activity up to this date (YYYY-MM-DD)")
+async def check_user_tokens(interaction: discord.Interaction, member: discord.Member,
+                            days: int = None, start_date: str = None, end_date: str = None):
     if not is_admin(interaction.user):
         await interaction.response.send_message("❌ Only admins can use this command.", ephemeral=True)
         return
     
+    try:
+        start, end = parse_date_range(start_date, end_date, days)
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ Invalid date range: {str(e)}", ephemeral=True)
+        return
+    
     await interaction.response.defer(ephemeral=False)
     
     # Get user's token summary
-    total_given, total_deposited, current_balance, net_tokens, total_removed = get_user_token_summary(
+    total_given, total_deposited, current_balance, net_tokens, total_removed = await ledger_client.call(
+        'get_user_token_summary',
         interaction.guild.name, 
         member.id, 
-        member.name
+        member.name,
+        interaction.guild_id
     )
     
+    # Date-limited history is summed from the daily rollups instead of the raw log
+    if start or end:
+        _, total_deposited, _, total_given = await ledger_client.call(
+            'get_user_rollup_totals', interaction.guild.name, list(get_log_names(member)), start, end)
+    
     # Create a detailed embed
     embed = discord.Embed(
         title=f"📊 Token History: {member.display_name}",
-        description="*Complete token transaction summary*",
+        description="*Complete token transaction summary*" if not (start or end)
+                    else f"*Token transaction summary for {format_date_range(start, end)}*",
         color=discord.Color.from_rgb(100, 149, 237))
     
     # Add user avatar
@@ -827,44 +2922,119 @@ async def check_user_tokens(interaction: discord.Interaction, member: discord.Me
     embed.timestamp = discord.utils.utcnow()
     
     # Log this admin action
-    log_transaction(interaction.guild.name, 
-                   "ADMIN_CHECK_USER_TOKENS", 
-                   admin=interaction.user, 
-                   member=member)
+    log_audit_event(interaction.guild.name, 
+                    "ADMIN_CHECK_USER_TOKENS", 
+                    admin=interaction.user, 
+                    member=member)
     
     await interaction.followup.send(embed=embed)
 
+# Admin command for a guild-wide token leaderboard computed in a single log pass
+@bot.tree.command(name="token_report",
+                  description="Guild-wide token history leaderboard (Admin only)")
+@app_commands.describe(sort_by="Sort by given, deposited, removed or net tokens",
+                       entries="Number of users to show (default: 10)",
+                       days="Only include the last N days",
+                       start_date="Only include activity from this date (YYYY-MM-DD)",
+                       end_date="Only include activity up to this date (YYYY-MM-DD)")
+@app_commands.choices(sort_by=[app_commands.Choice(name=key, value=key) for key in REPORT_SORT_KEYS])
+async def token_report(interaction: discord.Interaction, sort_by: str = "given",
+                       entries: int = DEFAULT_REPORT_ENTRIES, days: int = None,
+                       start_date: str = None, end_date: str = None):
+    if not is_admin(interaction.user):
+        await interaction.response.send_message("❌ Only admins can use this command.", ephemeral=True)
+        return
+
+    try:
+        start, end = parse_date_range(start_date, end_date, days)
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ Invalid date range: {str(e)}", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+
+    if entries <= 0:
+        entries = DEFAULT_REPORT_ENTRIES
+
+    if start or end:
+        # Date-limited reports only sum the matching daily buckets
+        guild_aggregates = await ledger_client.call('get_guild_rollup_totals', interaction.guild.name, start, end)
+    else:
+        # The log scan runs off the event loop so other commands keep responding
+        aggregates = await ledger_client.call('compute_log_aggregates', interaction.guild.name)
+        guild_aggregates = aggregates.get(interaction.guild.name, {})
+    ranked = build_token_report(guild_aggregates, sort_by, entries)
+
+    embed = discord.Embed(
+        title="📊 Token Report",
+        description=f"*Top {len(ranked)} users by tokens {sort_by} ({format_date_range(start, end)})*",
+        color=discord.Color.from_rgb(100, 149, 237))
+
+    if ranked:
+        report_text = ""
+        for i, (name, stats) in enumerate(ranked):
+            report_text += f"**{i+1}. {name}** - {stats[sort_by]}\n"
+            report_text += f"   🎁 {stats['given']} given • 🏦 {stats['deposited']} deposited • ➖ {stats['removed']} removed\n"
+        embed.add_field(name="Leaderboard", value=report_text[:1024], inline=False)
+    else:
+        embed.add_field(name="Leaderboard", value="*No token activity recorded.*", inline=False)
+
+    totals = new_user_aggregate()
+    for stats in guild_aggregates.values():
+        for key in totals:
+            totals[key] += stats[key]
+
+    embed.set_footer(text=f"🎁 {totals['given']} given • 🏦 {totals['deposited']} deposited • 👥 {len(guild_aggregates)} users")
+    embed.timestamp = discord.utils.utcnow()
+
+    log_audit_event(interaction.guild.name, "TOKEN_REPORT", admin=interaction.user)
+
+    await interaction.followup.send(embed=embed)
+
 # Command to check personal balance
 @bot.tree.command(name="balance", description="Check your token balance")
 async def check_balance(interaction: discord.Interaction):
     # Defer the response (use ephemeral for private response)
     await interaction.response.defer(ephemeral=True)
     
-    # Load token data
-    token_data = load_token_data()
-    guild_id = str(interaction.guild_id)
-    user_id = str(interaction.user.id)
-
     # Get token count
-    tokens = 0
-    if guild_id in token_data and user_id in token_data[guild_id]:
-        tokens = token_data[guild_id][user_id]
+    tokens = await ledger_client.call('get_balance', interaction.guild_id, interaction.user.id)
+    grants = await ledger_client.call('get_grants', interaction.guild_id, interaction.user.id) if TOKEN_EXPIRY_DAYS else []
 
     # Log transaction
-    log_transaction(interaction.guild.name,
+    log_audit_event(interaction.guild.name,
                     "CHECK_PERSONAL_BALANCE",
                     member=interaction.user)
 
-    await interaction.followup.send(f"You currently have {tokens} callout token(s).")
+    message = f"You currently have {tokens} callout token(s)."
+    if grants:
+        expires_at, amount = grants[0]
+        message += f" {amount} of them expire <t:{int(expires_at)}:R>."
+    await interaction.followup.send(message)
 
 # Command to view transaction log (Admin only)
 @bot.tree.command(name="log", description="View recent token transactions (Admin only)")
-@app_commands.describe(entries="Number of log entries to show (default: 10)")
-async def view_log(interaction: discord.Interaction, entries: int = DEFAULT_LOG_ENTRIES):
+@app_commands.describe(entries="Number of log entries to show (default: 10)",
+                       action="Only show this type of transaction",
+                       member="Only show transactions for this member",
+                       admin="Only show transactions performed by this admin",
+                       days="Only show the last N days",
+                       start_date="Only show entries from this date (YYYY-MM-DD)",
+                       end_date="Only show entries up to this date (YYYY-MM-DD)")
+@app_commands.choices(action=[app_commands.Choice(name=name, value=name) for name in LOG_ACTIONS])
+async def view_log(interaction: discord.Interaction, entries: int = DEFAULT_LOG_ENTRIES,
+                   action: str = None, member: discord.Member = None, admin: discord.Member = None,
+                   days: int = None, start_date: str = None, end_date: str = None):
     if not is_admin(interaction.user):
         await interaction.response.send_message("❌ Only admins can use this command.", ephemeral=True)
         return
 
+    try:
+        start, end = parse_date_range(start_date, end_date, days)
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ Invalid date range: {str(e)}", ephemeral=True)
+        return
+
     # Defer the response to prevent timeout
     await interaction.response.defer(ephemeral=True)
     
@@ -872,17 +3042,33 @@ async def view_log(interaction: discord.Interaction, entries: int = DEFAULT_LOG_
     if entries <= 0:
         entries = DEFAULT_LOG_ENTRIES
 
-    # Get recent log entries
-    try:
-        with open(LOG_FILE, 'r') as f:
-            log_lines = f.readlines()
-
-        recent_logs = log_lines[-entries:] if len(log_lines) >= entries else log_lines
+    filtered = action or member or admin or start or end
 
-        # Format logs for Discord
-        log_content = "**Recent Token Transactions:**\n```"
-        for line in recent_logs:
-            log_content += line.strip() + "\n"
+    # Get recent log entries; without filters this is the guild's last entries across log segments
+    try:
+        recent_logs = await ledger_client.call(
+            'query_log',
+            interaction.guild.name,
+            action,
+            list(get_log_names(member)) if member else None,
+            list(get_log_names(admin)) if admin else None,
+            start,
+            end,
+            entries)
+
+        if not recent_logs:
+            await interaction.followup.send("No matching log entries found.")
+            return
+
+        # Format logs for Discord, dropping the oldest lines if the message would be too long
+        lines = [line.strip() for line in recent_logs]
+        while len(lines) > 1 and sum(len(line) + 1 for line in lines) > MAX_LOG_MESSAGE_LENGTH:
+            lines.pop(0)
+
+        title = "**Matching Token Transactions:**" if filtered else "**Recent Token Transactions:**"
+        log_content = title + "\n```"
+        for line in lines:
+            log_content += line + "\n"
         log_content += "```"
 
         await interaction.followup.send(log_content)
@@ -908,44 +3094,378 @@ async def remove_tokens(interaction: discord.Interaction,
         await interaction.followup.send("❌ Amount must be a positive number.")
         return
 
-    # Load token data
-    token_data = load_token_data()
-    guild_id = str(interaction.guild_id)
-    user_id = str(member.id)
+    current_tokens = await ledger_client.call('get_balance', interaction.guild_id, member.id)
 
     # Check if user has any tokens
-    if guild_id not in token_data or user_id not in token_data[guild_id]:
+    if current_tokens == 0:
         await interaction.followup.send(f"❌ {member.mention} doesn't have any tokens to remove.")
         return
 
-    current_tokens = token_data[guild_id][user_id]
-
     # Check if user has enough tokens
     if current_tokens < amount:
         await interaction.followup.send(
             f"❌ {member.mention} only has {current_tokens} token(s), but you're trying to remove {amount}.")
         return
 
-    # Update token count
-    token_data[guild_id][user_id] -= amount
-
-    # Remove user from data if they have 0 tokens
-    if token_data[guild_id][user_id] == 0:
-        del token_data[guild_id][user_id]
-        remaining = 0
-    else:
-        remaining = token_data[guild_id][user_id]
-
-    # Save token data
-    save_token_data(token_data)
+    # Update token count (users with 0 tokens are dropped from the ledger)
+    try:
+        new_balances = await ledger_client.call('apply_changes', interaction.guild_id, {member.id: -amount}, "REMOVE_TOKENS")
+    except ValueError:
+        await interaction.followup.send(
+            f"❌ {member.mention}'s balance changed and no longer covers {amount} token(s). Please try again.")
+        return
+    remaining = new_balances[str(member.id)]
 
     # Log transaction
-    log_transaction(interaction.guild.name, "REMOVE_TOKENS", interaction.user,
+    log_transaction(interaction.guild, "REMOVE_TOKENS", interaction.user,
                     member, amount)
 
     await interaction.followup.send(
         f"✅ Successfully removed {amount} token(s) from {member.mention}. They now have {remaining} token(s) remaining.")
 
+# Resolve the members targeted by a bulk command from a role and/or a list of mentions or IDs
+def resolve_bulk_members(guild, role=None, members_text=None):
+    """
+    Uses the member cache only, so no REST calls are made
+    Returns: (members, unresolved_ids)
+    """
+    targets = {}
+    if role is not None:
+        for member in role.members:
+            if not member.bot:
+                targets[member.id] = member
+
+    unresolved = []
+    if members_text:
+        for user_id in re.findall(r"\d{15,20}", members_text):
+            member = guild.get_member(int(user_id))
+            if member is None:
+                unresolved.append(user_id)
+            else:
+                targets[member.id] = member
+
+    return list(targets.values()), unresolved
+
+# Format a list of members for a bulk command reply, keeping the message short
+def format_member_list(members, limit=20):
+    names = ", ".join(member.display_name for member in members[:limit])
+    if len(members) > limit:
+        names += f" and {len(members) - limit} more"
+    return names
+
+# Command to give tokens to many members at once (Admin only)
+@bot.tree.command(name="give_tokens_bulk",
+                  description="Give callout tokens to a role or several members at once (Admin only)")
+@app_commands.describe(amount="Number of tokens to give each member (1-3)",
+                       role="Give tokens to every member with this role",
+                       members="Members to give tokens to (mentions or IDs)")
+async def give_tokens_bulk(interaction: discord.Interaction, amount: int,
+                           role: discord.Role = None, members: str = None):
+    await interaction.response.defer(ephemeral=False)
+
+    if not is_admin(interaction.user):
+        await interaction.followup.send("❌ Only admins can use this command.")
+        return
+
+    if amount < 1 or amount > 3:
+        await interaction.followup.send("❌ You can only give 1-3 tokens at a time.")
+        return
+
+    targets, unresolved = resolve_bulk_members(interaction.guild, role, members)
+    if not targets:
+        await interaction.followup.send("❌ No members to give tokens to. Pick a role or list members.")
+        return
+
+    # Check every cap before changing anything
+    balances = await ledger_client.call('get_balances', interaction.guild_id, [member.id for member in targets])
+    over_cap = [member for member in targets if balances[str(member.id)] + amount > MAX_TOKENS_PER_USER]
+    if over_cap:
+        await interaction.followup.send(
+            f"❌ No tokens were given. {len(over_cap)} member(s) would exceed the maximum of {MAX_TOKENS_PER_USER}: "
+            f"{format_member_list(over_cap)}")
+        return
+
+    # One ledger event and one log append for the whole batch
+    try:
+        await ledger_client.call('apply_changes', interaction.guild_id,
+                                 {member.id: amount for member in targets}, "GIVE_TOKENS", MAX_TOKENS_PER_USER,
+                                 token_expiry_timestamp(), interaction.guild.name)
+    except ValueError:
+        await interaction.followup.send("❌ Balances changed while giving tokens, so none were given. Please try again.")
+        return
+
+    log_transactions([(interaction.guild, "GIVE_TOKENS", interaction.user, member, amount)
+                      for member in targets])
+
+    message = f"✅ Successfully gave {amount} token(s) to {len(targets)} member(s): {format_member_list(targets)}."
+    if unresolved:
+        message += f"\n⚠️ {len(unresolved)} listed user(s) are not in this server and were skipped."
+    await interaction.followup.send(message)
+
+# Command to remove tokens from many members at once (Admin only)
+@bot.tree.command(name="remove_tokens_bulk",
+                  description="Remove callout tokens from a role or several members at once (Admin only)")
+@app_commands.describe(amount="Number of tokens to remove from each member",
+                       role="Remove tokens from every member with this role",
+                       members="Members to remove tokens from (mentions or IDs)")
+async def remove_tokens_bulk(interaction: discord.Interaction, amount: int,
+                             role: discord.Role = None, members: str = None):
+    await interaction.response.defer(ephemeral=False)
+
+    if not is_admin(interaction.user):
+        await interaction.followup.send("❌ Only admins can use this command.")
+        return
+
+    if amount <= 0:
+        await interaction.followup.send("❌ Amount must be a positive number.")
+        return
+
+    targets, unresolved = resolve_bulk_members(interaction.guild, role, members)
+    if not targets:
+        await interaction.followup.send("❌ No members to remove tokens from. Pick a role or list members.")
+        return
+
+    # Check every balance before changing anything
+    balances = await ledger_client.call('get_balances', interaction.guild_id, [member.id for member in targets])
+    short = [member for member in targets if balances[str(member.id)] < amount]
+    if short:
+        await interaction.followup.send(
+            f"❌ No tokens were removed. {len(short)} member(s) have fewer than {amount} token(s): "
+            f"{format_member_list(short)}")
+        return
+
+    # One ledger event and one log append for the whole batch
+    try:
+        await ledger_client.call('apply_changes', interaction.guild_id,
+                                 {member.id: -amount for member in targets}, "REMOVE_TOKENS")
+    except ValueError:
+        await interaction.followup.send("❌ Balances changed while removing tokens, so none were removed. Please try again.")
+        return
+
+    log_transactions([(interaction.guild, "REMOVE_TOKENS", interaction.user, member, amount)
+                      for member in targets])
+
+    message = f"✅ Successfully removed {amount} token(s) from {len(targets)} member(s): {format_member_list(targets)}."
+    if unresolved:
+        message += f"\n⚠️ {len(unresolved)} listed user(s) are not in this server and were skipped."
+    await interaction.followup.send(message)
+
+# Columns of each export
+EXPORT_FIELDS = {
+    "balances": ["user_id", "name", "tokens"],
+    "history": ["timestamp", "action", "admin", "member", "amount"],
+}
+
+# All files holding transaction history right now, oldest first
+def list_history_files():
+    """
+    Read from disk rather than the cached checkpoint, and without finishing pending rotations,
+    so it reflects segments rotated since the checkpoint was loaded
+    Returns: archived segment paths, then logs still being rotated, then the live log
+    """
+    archived = [os.path.join(LOG_ARCHIVE_DIR, segment['file']) for segment in read_log_checkpoint()['segments']]
+    return archived + find_rotating_logs() + [LOG_FILE]
+
+# Stream a guild's history from a list of history files, oldest first
+def iter_guild_history(guild_name, history_files):
+    for path in history_files:
+        for entry, _ in iter_history_lines(path, guild_name):
+            yield entry
+
+# Write rows into temporary files of at most EXPORT_PART_BYTES, yielding each path when it is full
+def iter_export_parts(rows, export_format, fieldnames):
+    """
+    rows: iterable of dicts with the keys in fieldnames
+    Only one row is formatted at a time; every CSV part repeats the header so it can be read alone.
+    The caller deletes the yielded files.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction='ignore')
+
+    # Format one row (or the header) as bytes
+    def encode(row=None):
+        buffer.seek(0)
+        buffer.truncate()
+        if export_format == "csv" and row is None:
+            writer.writeheader()
+        elif export_format == "csv":
+            writer.writerow(row)
+        elif row is not None:
+            buffer.write(json.dumps({key: row[key] for key in fieldnames}) + '\n')
+        return buffer.getvalue().encode('utf-8')
+
+    header = encode()
+    part = None
+    part_size = 0
+    try:
+        for row in rows:
+            line = encode(row)
+            if part is not None and part_size + len(line) > EXPORT_PART_BYTES:
+                part.close()
+                yield part.name
+                part = None
+            if part is None:
+                part = tempfile.NamedTemporaryFile('wb', suffix='.' + export_format, delete=False)
+                part.write(header)
+                part_size = len(header)
+            part.write(line)
+            part_size += len(line)
+        if part is not None:
+            part.close()
+            yield part.name
+            part = None
+    finally:
+        if part is not None:
+            part.close()
+            os.remove(part.name)
+
+# Parse one line of a balances import, returning (user_id, tokens)
+def parse_import_row(line, import_format, header):
+    if import_format == "jsonl":
+        row = json.loads(line)
+    else:
+        row = dict(zip(header, next(csv.reader([line]))))
+    user_id = str(row['user_id']).strip()
+    if not user_id.isdigit():
+        raise ValueError(f"invalid user_id {user_id!r}")
+    tokens = int(row['tokens'])
+    if not 0 <= tokens <= MAX_TOKENS_PER_USER:
+        raise ValueError(f"tokens must be between 0 and {MAX_TOKENS_PER_USER}")
+    return user_id, tokens
+
+# Command to export balances or history (Admin only)
+@bot.tree.command(name="export", description="Export this server's balances or transaction history (Admin only)")
+@app_commands.describe(data="What to export", export_format="File format")
+@app_commands.choices(data=[app_commands.Choice(name=name, value=name) for name in EXPORT_FIELDS],
+                      export_format=[app_commands.Choice(name="CSV", value="csv"),
+                                     app_commands.Choice(name="JSON Lines", value="jsonl")])
+async def export_data(interaction: discord.Interaction, data: str = "balances", export_format: str = "csv"):
+    if not is_admin(interaction.user):
+        await interaction.response.send_message("❌ Only admins can use this command.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+
+    if data == "balances":
+        guild_balances = await ledger_client.call('get_guild_balances', interaction.guild_id)
+        rows = ({"user_id": user_id, "tokens": tokens,
+                 "name": getattr(interaction.guild.get_member(int(user_id)), 'name', "")}
+                for user_id, tokens in sorted(guild_balances.items(), key=lambda item: int(item[0])))
+    else:
+        # The process that owns the log knows which segments exist
+        history_files = await ledger_client.call('list_history_files')
+        rows = ({"timestamp": entry['timestamp'].strftime(LOG_TIMESTAMP_FORMAT), "action": entry['action'],
+                 "admin": entry['admin'] or "", "member": entry['member'] or "", "amount": entry['amount'] or ""}
+                for entry in iter_guild_history(interaction.guild.name, history_files))
+
+    # Parts are written off the event loop and uploaded one at a time as they fill up
+    parts = iter_export_parts(rows, export_format, EXPORT_FIELDS[data])
+    part_count = 0
+    try:
+        while True:
+            path = await asyncio.to_thread(next, parts, None)
+            if path is None:
+                break
+            part_count += 1
+            try:
+                await interaction.followup.send(
+                    f"📦 {data.capitalize()} export part {part_count}",
+                    file=discord.File(path, filename=f"{data}_{interaction.guild_id}_part{part_count}.{export_format}"),
+                    ephemeral=True)
+            finally:
+                os.remove(path)
+    except Exception as e:
+        print(f"Error exporting {data}: {str(e)}")
+        await interaction.followup.send(f"❌ Export failed after {part_count} part(s): {str(e)}", ephemeral=True)
+        return
+    finally:
+        parts.close()
+
+    if part_count == 0:
+        await interaction.followup.send(f"No {data} to export for this server.", ephemeral=True)
+        return
+
+    log_audit_event(interaction.guild.name, "EXPORT_DATA", admin=interaction.user)
+    await interaction.followup.send(f"✅ Exported {data} in {part_count} file(s).", ephemeral=True)
+
+# Command to import balances from an export (Admin only)
+@bot.tree.command(name="import_balances", description="Set balances from a CSV or JSONL balances export (Admin only)")
+@app_commands.describe(file="Balances file with user_id and tokens columns",
+                       replace_all="Also clear the tokens of everyone not listed in the file")
+async def import_balances(interaction: discord.Interaction, file: discord.Attachment, replace_all: bool = False):
+    await interaction.response.defer(ephemeral=False)
+
+    if not is_admin(interaction.user):
+        await interaction.followup.send("❌ Only admins can use this command.")
+        return
+
+    import_format = file.filename.rsplit('.', 1)[-1].lower()
+    if import_format not in ("csv", "jsonl"):
+        await interaction.followup.send("❌ The file must be a .csv or .jsonl balances export.")
+        return
+
+    # Stream the attachment line by line, keeping only the parsed balances
+    imported = {}
+    errors = []
+    try:
+        async with get_http_session().get(file.url) as resp:
+            resp.raise_for_status()
+            header = None
+            line_number = 0
+            async for raw_line in resp.content:
+                line_number += 1
+                line = raw_line.decode('utf-8-sig').strip()
+                if not line:
+                    continue
+                if import_format == "csv" and header is None:
+                    header = next(csv.reader([line]))
+                    if "user_id" not in header or "tokens" not in header:
+                        errors.append("line 1: header must contain user_id and tokens")
+                        break
+                    continue
+                try:
+                    user_id, tokens = parse_import_row(line, import_format, header)
+                    if user_id in imported:
+                        raise ValueError(f"duplicate user_id {user_id}")
+                    imported[user_id] = tokens
+                except (ValueError, KeyError, TypeError) as e:
+                    errors.append(f"line {line_number}: {str(e)}")
+    except Exception as e:
+        print(f"Error reading import file: {str(e)}")
+        await interaction.followup.send(f"❌ Could not read the file: {str(e)}")
+        return
+
+    if errors:
+        shown = "\n".join(errors[:10])
+        more = f"\n...and {len(errors) - 10} more" if len(errors) > 10 else ""
+        await interaction.followup.send(f"❌ Nothing was imported. {len(errors)} invalid line(s):\n{shown}{more}")
+        return
+
+    # Turn the target balances into one batch of deltas
+    current = await ledger_client.call('get_guild_balances', interaction.guild_id)
+    if replace_all:
+        for user_id in current:
+            imported.setdefault(user_id, 0)
+    changes = {user_id: tokens - current.get(user_id, 0) for user_id, tokens in imported.items()
+               if tokens != current.get(user_id, 0)}
+    if not changes:
+        await interaction.followup.send("✅ Balances already match the file; nothing to change.")
+        return
+
+    try:
+        await ledger_client.call('apply_changes', interaction.guild_id, changes, "IMPORT_BALANCES",
+                                 MAX_TOKENS_PER_USER, token_expiry_timestamp(), interaction.guild.name)
+    except ValueError:
+        await interaction.followup.send("❌ Balances changed during the import, so nothing was imported. Please try again.")
+        return
+
+    log_transactions([(interaction.guild, "IMPORT_BALANCES", interaction.user,
+                       interaction.guild.get_member(int(user_id)) or f"<@{user_id}>",
+                       f"{current.get(user_id, 0)} -> {imported[user_id]}")
+                      for user_id in changes])
+
+    await interaction.followup.send(f"✅ Imported balances from {file.filename}: {len(changes)} member(s) updated.")
+
 # Command to view server token statistics (Admin only)
 @bot.tree.command(name="stats", description="View server token statistics (Admin only)")
 async def view_stats(interaction: discord.Interaction):
@@ -956,18 +3476,17 @@ async def view_stats(interaction: discord.Interaction):
     # Defer the response
     await interaction.response.defer(ephemeral=True)
     
-    # Load token data
-    token_data = load_token_data()
-    guild_id = str(interaction.guild_id)
+    # Get the guild's balances
+    guild_balances = await ledger_client.call('get_guild_balances', interaction.guild_id)
     
-    if guild_id not in token_data or not token_data[guild_id]:
+    if not guild_balances:
         await interaction.followup.send("No token data available for this server.")
         return
         
     # Calculate statistics
-    total_tokens = sum(token_data[guild_id].values())
-    unique_users = len(token_data[guild_id])
-    max_tokens = max(token_data[guild_id].values()) if token_data[guild_id] else 0
+    total_tokens = sum(guild_balances.values())
+    unique_users = len(guild_balances)
+    max_tokens = max(guild_balances.values()) if guild_balances else 0
     avg_tokens = total_tokens / unique_users if unique_users > 0 else 0
     
     # Create embed
@@ -984,6 +3503,41 @@ async def view_stats(interaction: discord.Interaction):
     await interaction.followup.send(embed=embed)
 
 
+# Command to view Discord REST usage per command (Admin only)
+@bot.tree.command(name="rest_stats", description="View Discord API usage and rate limits per command (Admin only)")
+@app_commands.describe(command="Only show routes used by this command")
+async def view_rest_stats(interaction: discord.Interaction, command: str = None):
+    if not is_admin(interaction.user):
+        await interaction.response.send_message("❌ Only admins can use this command.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+
+    metrics = get_rest_metrics()
+    if command:
+        metrics = {command: metrics.get(command, {})}
+
+    embed = discord.Embed(
+        title="📡 Discord API Usage",
+        description="*REST calls since the bot started, by command*",
+        color=discord.Color.blue()
+    )
+
+    # Commands with the most time spent in REST calls first
+    ranked = sorted(metrics.items(), key=lambda x: -sum(stats['latency'] for stats in x[1].values()))
+    for command_name, routes in ranked[:25]:
+        route_text = ""
+        for route_key, stats in sorted(routes.items(), key=lambda x: -x[1]['latency']):
+            route_text += (f"`{route_key}` {stats['calls']}× avg {stats['avg_latency'] * 1000:.0f}ms"
+                           f" • 429s {stats['rate_limited']} • waited {stats['rate_limit_wait']:.1f}s\n")
+        embed.add_field(name=f"/{command_name}" if command_name != BACKGROUND_COMMAND else command_name,
+                        value=route_text[:1024] or "*No calls recorded.*", inline=False)
+
+    if not ranked:
+        embed.add_field(name="No data", value="*No REST calls recorded yet.*", inline=False)
+
+    await interaction.followup.send(embed=embed)
+
 # Command to reset all tokens (Admin only)
 @bot.tree.command(name="reset_all_tokens", description="Remove all tokens from all members (Admin only)")
 async def reset_all_tokens(interaction: discord.Interaction):
@@ -995,27 +3549,23 @@ async def reset_all_tokens(interaction: discord.Interaction):
         await interaction.followup.send("❌ Only admins can use this command.", ephemeral=True)
         return
 
-    # Load token data
-    token_data = load_token_data()
-    guild_id = str(interaction.guild_id)
+    # Get the guild's balances
+    guild_balances = await ledger_client.call('get_guild_balances', interaction.guild_id)
 
     # Check if there are any tokens to reset
-    if guild_id not in token_data or not token_data[guild_id]:
+    if not guild_balances:
         await interaction.followup.send("No tokens to reset.", ephemeral=True)
         return
 
     # Count total tokens before reset
-    total_tokens = sum(token_data[guild_id].values())
-    unique_users = len(token_data[guild_id])
+    total_tokens = sum(guild_balances.values())
+    unique_users = len(guild_balances)
 
     # Reset tokens for the guild
-    token_data[guild_id] = {}
-
-    # Save token data
-    save_token_data(token_data)
+    await ledger_client.call('reset_guild', interaction.guild_id)
 
     # Log transaction
-    log_transaction(interaction.guild.name, 
+    log_transaction(interaction.guild, 
                     "RESET_ALL_TOKENS", 
                     member=interaction.user, 
                     amount=total_tokens)
@@ -1052,9 +3602,9 @@ async def bank_help_command(interaction: discord.Interaction):
     
     for cmd in commands_list:
         # Filter to include all commands - lagt till check_user_balance här
-        if cmd.name in ["balance", "balances", "deposit", "bank-help", "check_user_balance", "verify-balance"]:
+        if cmd.name in ["balance", "balances", "deposit", "bank-help", "check_user_balance", "verify-balance", "verify-team"]:
             user_commands.append(f"• `/{cmd.name}` - {cmd.description}")
-        elif cmd.name in ["give_tokens", "remove_tokens", "reset_all_tokens", "log", "create_backup", "list_backups", "restore_backup", "confirm_restore", "stats", "user_tokens"]:
+        elif cmd.name in ["give_tokens", "remove_tokens", "give_tokens_bulk", "remove_tokens_bulk", "reset_all_tokens", "log", "create_backup", "list_backups", "restore_backup", "confirm_restore", "stats", "user_tokens", "token_report", "rest_stats", "export", "import_balances"]:
             admin_commands.append(f"• `/{cmd.name}` - {cmd.description}")
     
     # Add sections to embed
@@ -1069,7 +3619,7 @@ async def bank_help_command(interaction: discord.Interaction):
                         inline=False)
     
     # Log command usage
-    log_transaction(interaction.guild.name,
+    log_audit_event(interaction.guild.name,
                     "BANK_HELP_COMMAND",
                     member=interaction.user)
     
@@ -1082,10 +3632,365 @@ def start_server():
     server_thread.daemon = True
     server_thread.start()
 
+# Ledger operations available to command handlers, locally or through the coordinator
+LEDGER_OPS = {
+    'get_balance': ledger.get_balance,
+    'get_balances': ledger.get_balances,
+    'get_guild_balances': ledger.get_guild_balances,
+    'get_grants': ledger.get_grants,
+    'apply_changes': ledger.apply_changes,
+    'reset_guild': ledger.reset_guild,
+    'backup_token_data': backup_token_data,
+    'restore_token_data': restore_token_data,
+    'diff_backup': diff_backup,
+    'get_user_token_summary': get_user_token_summary,
+    'get_user_rollup_totals': get_user_rollup_totals,
+    'get_guild_rollup_totals': get_guild_rollup_totals,
+    'compute_log_aggregates': lambda *args: asyncio.to_thread(compute_log_aggregates, *args),
+    'query_log': query_log,
+    'write_log_entries': write_log_entries,
+    'list_history_files': list_history_files,
+    'record_audit_event': record_audit_event,
+}
+
+# Exceptions that are re-raised on the calling side of the coordinator
+LEDGER_ERRORS = {'ValueError': ValueError, 'KeyError': KeyError}
+
+# Run one ledger operation in this process
+async def execute_ledger_op(op, args):
+    result = LEDGER_OPS[op](*args)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+# JSON encoding for coordinator messages (dates and sets are not native JSON)
+def encode_ledger_value(value):
+    if isinstance(value, datetime.date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Cannot send {type(value).__name__} to the ledger coordinator")
+
+def decode_ledger_value(value):
+    if '__date__' in value:
+        return datetime.date.fromisoformat(value['__date__'])
+    return value
+
+def encode_ledger_frame(frame):
+    return (json.dumps(frame, default=encode_ledger_value, separators=(',', ':')) + '\n').encode('utf-8')
+
+def decode_ledger_frame(raw_line):
+    return json.loads(raw_line, object_hook=decode_ledger_value)
+
+# Ledger client for single-process mode: calls go straight to the resident ledger
+class LocalLedgerClient:
+    async def call(self, op, *args):
+        return await execute_ledger_op(op, args)
+
+    def send_logs(self, log_entries):
+        write_log_entries(log_entries)
+
+    def send_audit_event(self, guild_name, action, log_entry):
+        record_audit_event(guild_name, action, log_entry)
+
+# Ledger client for sharded mode: calls go to the coordinator over a Unix socket
+class RemoteLedgerClient:
+    """
+    Calls made during the same event loop iteration are sent as one batch, and the
+    coordinator answers each batch with one message
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.reader = None
+        self.writer = None
+        self.pending = []
+        self.futures = {}
+        self.next_id = 0
+        self.flush_scheduled = False
+        self.send_lock = asyncio.Lock()
+
+    async def call(self, op, *args):
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.futures[self.next_id] = future
+        self.enqueue({'id': self.next_id, 'op': op, 'args': args})
+        return await future
+
+    # Fire-and-forget log writes, delivered with the next batch
+    def send_logs(self, log_entries):
+        self.enqueue({'id': None, 'op': 'write_log_entries', 'args': [log_entries]})
+
+    # Fire-and-forget audit event, counted and written by the coordinator
+    def send_audit_event(self, guild_name, action, log_entry):
+        self.enqueue({'id': None, 'op': 'record_audit_event', 'args': [guild_name, action, log_entry]})
+
+    def enqueue(self, request):
+        self.pending.append(request)
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().create_task(self.flush())
+
+    async def connect(self):
+        if self.writer is None or self.writer.is_closing():
+            self.reader, self.writer = await asyncio.open_unix_connection(self.socket_path, limit=LEDGER_FRAME_LIMIT)
+            asyncio.get_running_loop().create_task(self.read_responses(self.reader))
+
+    async def flush(self):
+        # Let every handler that is ready in this loop iteration add its request first
+        await asyncio.sleep(0)
+        batch, self.pending = self.pending, []
+        self.flush_scheduled = False
+
+        try:
+            async with self.send_lock:
+                await self.connect()
+                self.writer.write(encode_ledger_frame({'batch': batch}))
+                await self.writer.drain()
+        except Exception as e:
+            print(f"Error sending to ledger coordinator: {str(e)}")
+            for ledger_request in batch:
+                future = self.futures.pop(ledger_request['id'], None)
+                if future is not None and not future.done():
+                    future.set_exception(ConnectionError(f"Ledger coordinator unavailable: {str(e)}"))
+
+    async def read_responses(self, reader):
+        try:
+            while True:
+                raw_line = await reader.readline()
+                if not raw_line:
+                    break
+                for response in decode_ledger_frame(raw_line)['batch']:
+                    future = self.futures.pop(response['id'], None)
+                    if future is None or future.done():
+                        continue
+                    if 'error' in response:
+                        error_type = LEDGER_ERRORS.get(response['error_type'], RuntimeError)
+                        future.set_exception(error_type(response['error']))
+                    else:
+                        future.set_result(response['result'])
+        except Exception as e:
+            print(f"Error reading from ledger coordinator: {str(e)}")
+        finally:
+            # Fail everything still waiting on this connection; the next call reconnects
+            if reader is self.reader:
+                self.writer = None
+                for request_id, future in list(self.futures.items()):
+                    if not future.done():
+                        future.set_exception(ConnectionError("Ledger coordinator connection lost"))
+                    del self.futures[request_id]
+
+ledger_client = RemoteLedgerClient(LEDGER_SOCKET) if LEDGER_SOCKET else LocalLedgerClient()
+
+# Serve one bot process connected to the coordinator
+async def handle_coordinator_connection(reader, writer):
+    """
+    Synchronous operations (balance reads and ledger mutations) are executed in the order they
+    arrive and answered together per batch. Asynchronous ones (log queries, aggregates, backups,
+    restores) run as separate tasks and are answered on their own when they finish, so a slow
+    one never holds up the requests behind it.
+    """
+    write_lock = asyncio.Lock()
+    running = set()
+
+    # Send a batch of responses to the bot process
+    async def send(responses):
+        async with write_lock:
+            writer.write(encode_ledger_frame({'batch': responses}))
+            await writer.drain()
+
+    # Await an asynchronous operation and answer its request
+    async def finish(request_id, pending):
+        try:
+            response = {'id': request_id, 'result': await pending}
+        except Exception as e:
+            response = {'id': request_id, 'error': str(e), 'error_type': type(e).__name__}
+        if request_id is None:
+            return
+        try:
+            await send([response])
+        except Exception as e:
+            print(f"Coordinator connection error: {str(e)}")
+
+    try:
+        while True:
+            raw_line = await reader.readline()
+            if not raw_line:
+                break
+
+            responses = []
+            for ledger_request in decode_ledger_frame(raw_line)['batch']:
+                try:
+                    result = LEDGER_OPS[ledger_request['op']](*ledger_request['args'])
+                    if inspect.isawaitable(result):
+                        task = asyncio.get_running_loop().create_task(finish(ledger_request['id'], result))
+                        running.add(task)
+                        task.add_done_callback(running.discard)
+                        continue
+                    response = {'id': ledger_request['id'], 'result': result}
+                except Exception as e:
+                    response = {'id': ledger_request['id'], 'error': str(e), 'error_type': type(e).__name__}
+                if ledger_request['id'] is not None:
+                    responses.append(response)
+
+            if responses:
+                await send(responses)
+    except Exception as e:
+        print(f"Coordinator connection error: {str(e)}")
+    finally:
+        writer.close()
+
+# Run the ledger coordinator: owns the ledger, the transaction log and the web server
+async def run_coordinator(socket_path):
+    global ledger_loop, is_coordinator
+    is_coordinator = True
+    ledger.load()
+    ledger_loop = asyncio.get_running_loop()
+    start_server()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = await asyncio.start_unix_server(handle_coordinator_connection, path=socket_path, limit=LEDGER_FRAME_LIMIT)
+    print(f"Ledger coordinator listening on {socket_path}")
+
+    # Ledger maintenance runs here; the bot processes only reconcile their own guilds
+    schedule_job("backup", BACKUP_INTERVAL, backup_token_data)
+    schedule_job("verify_backups", BACKUP_VERIFY_INTERVAL, verify_backups)
+    schedule_job("log_flush", ROLLUP_FLUSH_INTERVAL, flush_logs)
+    schedule_job("keep_alive", KEEP_ALIVE_INTERVAL, keep_alive)
+    start_scheduler()
+    asyncio.get_running_loop().create_task(token_expiry_task())
+    async with server:
+        await server.serve_forever()
+
+def run_coordinator_cli(args):
+    try:
+        asyncio.run(run_coordinator(args.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        flush_rollups()
+        flush_audit_counters()
+
+# Launch a coordinator and several bot processes that split the gateway shards between them
+def run_sharded_cli(args):
+    # The coordinator owns the ledger itself, so it must not inherit sharded-mode settings
+    coordinator_env = {key: value for key, value in os.environ.items()
+                       if key not in ('SHARD_COUNT', 'SHARD_IDS', 'LEDGER_SOCKET')}
+    coordinator = subprocess.Popen([sys.executable, os.path.abspath(__file__), "coordinator", "--socket", args.socket],
+                                   env=coordinator_env)
+    processes = [coordinator]
+    try:
+        # Wait for the coordinator to accept connections
+        while not os.path.exists(args.socket):
+            if coordinator.poll() is not None:
+                print("Ledger coordinator failed to start")
+                return
+            time.sleep(0.1)
+
+        for index in range(args.processes):
+            shard_ids = [shard_id for shard_id in range(args.shard_count) if shard_id % args.processes == index]
+            if not shard_ids:
+                continue
+            env = dict(os.environ,
+                       SHARD_COUNT=str(args.shard_count),
+                       SHARD_IDS=",".join(str(shard_id) for shard_id in shard_ids),
+                       LEDGER_SOCKET=args.socket)
+            processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+            print(f"Started bot process for shards {shard_ids}")
+
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+# Offline token report from the command line: python main.py report --guild "My Server"
+def run_report_cli(args):
+    aggregates = compute_log_aggregates(args.guild, args.log_file)
+
+    if not aggregates:
+        print("No token activity found.")
+        return
+
+    for guild_name, guild_aggregates in sorted(aggregates.items()):
+        print(f"[{guild_name}] {len(guild_aggregates)} users")
+        ranked = build_token_report(guild_aggregates, args.sort_by, args.limit)
+        for i, (name, stats) in enumerate(ranked):
+            print(f"  {i+1:>3}. {name:<32} given={stats['given']} deposited={stats['deposited']} "
+                  f"removed={stats['removed']} net={stats['net']}")
+
+# Replay the whole event log and compare it with the snapshot-based state
+def run_verify_ledger_cli(args):
+    ledger.load()
+    replayed, replayed_grants = ledger.replay(ledger.seq)
+    if replayed == ledger.to_dict() and replayed_grants == ledger.grants:
+        print(f"Ledger OK: snapshot + tail matches a full replay of {ledger.seq} event(s)")
+    else:
+        print(f"Ledger MISMATCH at event {ledger.seq}: snapshot + tail differs from a full replay")
+        sys.exit(1)
+
+# Print how much memory each guild's ledger state takes
+def run_memory_report_cli(args):
+    ledger.load()
+    report = ledger.memory_report()
+    for guild_id, stats in sorted(report.items(), key=lambda item: -item[1]['balance_bytes']):
+        print(f"{guild_id:<20} holders={stats['holders']:<8} balances={stats['balance_bytes']:>10} B  "
+              f"grants={stats['grant_holders']:<8} ({stats['grant_bytes']} B)")
+    print(f"Total: {sum(stats['holders'] for stats in report.values())} holders in {len(report)} guild(s), "
+          f"{sum(stats['balance_bytes'] + stats['grant_bytes'] for stats in report.values())} B")
+
+# Command line entry points for offline tools
+def run_cli(argv):
+    parser = argparse.ArgumentParser(description="Token bot command line tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = subparsers.add_parser("report", help="Print a token leaderboard from the transaction log")
+    report_parser.add_argument("--guild", default=None, help="Only report on this guild name")
+    report_parser.add_argument("--sort-by", choices=REPORT_SORT_KEYS, default="given")
+    report_parser.add_argument("--limit", type=int, default=DEFAULT_REPORT_ENTRIES, help="Users per guild (0 for all)")
+    report_parser.add_argument("--log-file", default=None, help="Report on this file only instead of the live log and checkpoint")
+    report_parser.set_defaults(handler=run_report_cli)
+
+    verify_parser = subparsers.add_parser("verify-ledger", help="Check that the ledger snapshot matches a full event replay")
+    verify_parser.set_defaults(handler=run_verify_ledger_cli)
+
+    memory_parser = subparsers.add_parser("memory-report", help="Show the ledger's memory use per guild")
+    memory_parser.set_defaults(handler=run_memory_report_cli)
+
+    coordinator_parser = subparsers.add_parser("coordinator", help="Run the ledger coordinator for sharded mode")
+    coordinator_parser.add_argument("--socket", default=DEFAULT_LEDGER_SOCKET)
+    coordinator_parser.set_defaults(handler=run_coordinator_cli)
+
+    sharded_parser = subparsers.add_parser("sharded", help="Run a coordinator plus several sharded bot processes")
+    sharded_parser.add_argument("--processes", type=int, default=2, help="Number of bot processes")
+    sharded_parser.add_argument("--shard-count", type=int, default=2, help="Total number of gateway shards")
+    sharded_parser.add_argument("--socket", default=DEFAULT_LEDGER_SOCKET)
+    sharded_parser.set_defaults(handler=run_sharded_cli)
+
+    rollup_parser = subparsers.add_parser("rebuild-rollups", help="Rebuild the daily rollups from the transaction log")
+    rollup_parser.set_defaults(handler=lambda args: print(
+        f"Rebuilt rollups for {len(rebuild_rollups()['guilds'])} guild(s)"))
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+
 # Main function to start the bot
 if __name__ == "__main__":
-    # Start the web server
-    start_server()
+    # Offline tools run without connecting to Discord
+    if len(sys.argv) > 1:
+        run_cli(sys.argv[1:])
+        sys.exit(0)
+
+    if not LEDGER_SOCKET:
+        # Load the ledger from its latest snapshot and event log
+        ledger.load()
+        
+        # Start the web server
+        start_server()
     
     # Run the bot
     try: